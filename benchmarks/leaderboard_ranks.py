@@ -0,0 +1,74 @@
+"""Time RankIndex builds, rank lookups and score updates at leaderboard scale.
+
+Fills a throwaway database with 1M users by default, then times the full
+rebuild the leaderboard refresher does (query plus build), reports how much
+memory one index keeps per process, and times "my rank" lookups, top-N
+reads and the incremental updates a refresher poll applies.
+
+    python benchmarks/leaderboard_ranks.py [--users 1000000] [--lookups 100000] [--path /tmp/bench.db]
+"""
+import argparse, os, random, sqlite3, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from main import db, User, RankIndex, LEADERBOARD_SIZE, LEADERBOARD_REBUILD_ROWS
+
+def timed(label, count, action):
+    started = time.perf_counter()
+    for _ in range(count):
+        action()
+    elapsed = (time.perf_counter() - started) / count * 1_000_000
+    print(f"  {label}: {elapsed:.2f} us/op")
+
+def build_database(path, users):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO user (id, username, password, tokens, rating) VALUES (?, ?, 'x', 50, ?)",
+        ((user_id, f"player{user_id}", random.gauss(1000, 200)) for user_id in range(1, users + 1)))
+    conn.commit()
+    conn.close()
+    return engine
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--updates", type=int, default=LEADERBOARD_REBUILD_ROWS)
+    parser.add_argument("--path", default="leaderboard_bench.db")
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"Building {args.path} with {args.users} users...")
+    engine = build_database(args.path, args.users)
+
+    with engine.connect() as conn:
+        started = time.perf_counter()
+        rows = conn.execute(db.select(User.id, User.rating)).all()
+        queried = time.perf_counter() - started
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = RankIndex(rows)
+        built = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    del rows
+    print(f"Full rebuild: {queried + built:.2f} s ({queried:.2f} s query, {built:.2f} s build)")
+    print(f"Memory per index: {retained / 2**20:.1f} MiB kept ({retained / args.users:.1f} B/user), "
+          f"{peak / 2**20:.1f} MiB peak while building")
+
+    timed("my rank", args.lookups, lambda: index.rank(random.randrange(1, args.users + 1)))
+    timed(f"top {LEADERBOARD_SIZE}", args.lookups // 10, lambda: index.top(LEADERBOARD_SIZE))
+
+    def bump():
+        user_id = random.randrange(1, args.users + 1)
+        index.update(user_id, index.score(user_id) + random.randrange(1, 20))
+    timed("score update", args.updates, bump)
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
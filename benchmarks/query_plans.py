@@ -0,0 +1,124 @@
+"""Show SQLite query plans for the hot lookups with and without the model indexes.
+
+Builds a throwaway database with the app's schema and a synthetic economy
+(1M users by default), drops the secondary indexes declared on the models,
+prints EXPLAIN QUERY PLAN plus a timing for each lookup, then recreates the
+indexes and does the same again.
+
+    python benchmarks/query_plans.py [--users 1000000] [--path /tmp/bench.db]
+"""
+import argparse, os, random, sqlite3, sys, time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from main import db
+
+RARITIES = ["common", "rare", "epic", "legendary", "godly"]
+
+QUERIES = [
+    ("login / register lookup",
+     "SELECT * FROM user WHERE username = :username",
+     lambda users: {"username": f"player{random.randrange(users)}"}),
+    ("incoming pending trades",
+     "SELECT * FROM trade WHERE receiver_id = :user_id AND status = 'pending'",
+     lambda users: {"user_id": random.randrange(1, users + 1)}),
+    ("outgoing trades",
+     "SELECT * FROM trade WHERE sender_id = :user_id",
+     lambda users: {"user_id": random.randrange(1, users + 1)}),
+    ("pending trade dedup",
+     "SELECT * FROM trade WHERE sender_id = :sender_id AND receiver_id = :receiver_id "
+     "AND offeredHero_id = 1 AND requestedHero_id = 2 AND status = 'pending' LIMIT 1",
+     lambda users: {"sender_id": random.randrange(1, users + 1), "receiver_id": random.randrange(1, users + 1)}),
+    ("newest queued lineup",
+     "SELECT * FROM line_up WHERE is_queued = 1 ORDER BY timestamp DESC LIMIT 1",
+     lambda users: {}),
+    ("user's latest unqueued lineup",
+     "SELECT * FROM line_up WHERE user_id = :user_id AND is_queued = 0 ORDER BY timestamp DESC LIMIT 1",
+     lambda users: {"user_id": random.randrange(1, users + 1)}),
+    ("oldest queued lineup in a rating band",
+     "SELECT * FROM line_up WHERE is_queued IS 1 AND user_id != :user_id AND rating BETWEEN :low AND :high "
+     "ORDER BY timestamp, id LIMIT 1",
+     lambda users: {"user_id": random.randrange(1, users + 1), "low": 900, "high": 1100}),
+    ("heroes of one rarity",
+     "SELECT * FROM hero WHERE rarity = :rarity",
+     lambda users: {"rarity": random.choice(RARITIES)}),
+]
+
+def secondary_indexes():
+    return [index for table in db.metadata.sorted_tables for index in table.indexes]
+
+def build_database(path, users, heroes, trades, lineups):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    now = datetime.utcnow()
+    conn.executemany(
+        "INSERT INTO hero (id, name, description, image, rarity, greek_type) VALUES (?, ?, '', '', ?, 'Alpha')",
+        ((hero_id, f"Hero {hero_id}", random.choice(RARITIES)) for hero_id in range(1, heroes + 1)))
+    conn.executemany(
+        "INSERT INTO user (id, username, password, tokens) VALUES (?, ?, 'x', 50)",
+        ((user_id, f"player{user_id - 1}") for user_id in range(1, users + 1)))
+    conn.executemany(
+        "INSERT INTO trade (sender_id, offeredHero_id, receiver_id, requestedHero_id, status) VALUES (?, ?, ?, ?, ?)",
+        ((random.randrange(1, users + 1), random.randrange(1, heroes + 1), random.randrange(1, users + 1),
+          random.randrange(1, heroes + 1), random.choice(["pending", "accepted", "declined", "cancelled"]))
+         for _ in range(trades)))
+    conn.executemany(
+        "INSERT INTO line_up (user_id, hero_1, hero_2, hero_3, timestamp, is_queued, rating) VALUES (?, 1, 2, 3, ?, ?, ?)",
+        ((random.randrange(1, users + 1), now - timedelta(seconds=random.randrange(10_000_000)), random.random() < 0.001,
+          random.gauss(1000, 200)) for _ in range(lineups)))
+    conn.commit()
+    return conn
+
+def report(conn, users, runs):
+    for label, sql, params in QUERIES:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params(users)).fetchall()
+        started = time.perf_counter()
+        for _ in range(runs):
+            conn.execute(sql, params(users)).fetchall()
+        elapsed = (time.perf_counter() - started) / runs * 1000
+        print(f"  {label}: {elapsed:.3f} ms/query")
+        for row in plan:
+            print(f"      {row[-1]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--heroes", type=int, default=200)
+    parser.add_argument("--trades", type=int, default=500_000)
+    parser.add_argument("--lineups", type=int, default=500_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--path", default="query_plans_bench.db")
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"Building {args.path} with {args.users} users, {args.trades} trades, {args.lineups} lineups...")
+    conn = build_database(args.path, args.users, args.heroes, args.trades, args.lineups)
+
+    for index in secondary_indexes():
+        conn.execute(f"DROP INDEX {index.name}")
+    conn.execute("ANALYZE")
+    print("\nBefore (no secondary indexes):")
+    report(conn, args.users, args.runs)
+
+    for index in secondary_indexes():
+        columns = ", ".join(column.name for column in index.columns)
+        unique = "UNIQUE " if index.unique else ""
+        where = index.dialect_options["sqlite"]["where"]
+        where = f" WHERE {where}" if where is not None else ""
+        conn.execute(f"CREATE {unique}INDEX {index.name} ON {index.table.name} ({columns}){where}")
+    conn.execute("ANALYZE")
+    print("\nAfter (model indexes):")
+    report(conn, args.users, args.runs)
+
+    conn.close()
+    os.remove(args.path)
+
+if __name__ == "__main__":
+    main()
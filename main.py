@@ -1,17 +1,37 @@
-from flask import Flask, render_template, url_for, request, redirect, flash, jsonify
+from flask import Flask, render_template, url_for, request, redirect, flash, jsonify, g, has_request_context, session, make_response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_login import login_user, logout_user, login_required, current_user, UserMixin, LoginManager
 from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import Markup
+from array import array
+import bisect
+import hashlib
+import os
 import random
+import threading
+import time
+import zlib
 from datetime import timedelta, datetime
+from functools import wraps
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 import schedule
-from collections import defaultdict
-from battle_logic import simulate_battle, BattleResult
+from collections import defaultdict, OrderedDict
+from battle_logic import simulate_battle, replay_battle, snapshot_lineups, new_battle_seed, load_battle_log, BattleLog, BattleResult, TEAM_A, TEAM_B
+from tournament import RosterHero, run_tournament
+from roll_tables import load_roll_tables
+from ratings import START_RATING, K_FACTOR, rating_change, replay_ratings
+import click
+import numpy as np
 
 app = Flask(__name__)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///database.db'
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", 'sqlite:///database.db')
 app.config['SECRET_KEY'] = "XhTFLPqVmjMjs5cMyBLpNpcfC"
 app.config['REMEMBER_COOKIE_DURATION'] = timedelta(days=1)
 db = SQLAlchemy(app)
@@ -21,6 +41,33 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 ADMIN = "ADMIN_JASON"
+ROLL_TABLES = load_roll_tables()
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "query_count" in g:
+        g.query_count += 1
+
+def query_budget(limit):
+    """Fail (under testing) or log (in debug) when a view runs more than ``limit`` SQL statements."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not (app.debug or app.testing):
+                return view(*args, **kwargs)
+            g.query_count = 0
+            response = view(*args, **kwargs)
+            if g.query_count > limit:
+                message = f"{view.__name__} ran {g.query_count} queries (budget {limit})"
+                if app.testing:
+                    raise QueryBudgetExceeded(message)
+                app.logger.warning(message)
+            return response
+        return wrapper
+    return decorator
 
 user_heroes = db.Table('user_heroes',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
@@ -37,16 +84,26 @@ user_achievements = db.Table('user_achievements',
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(30), nullable=False)
+    username = db.Column(db.String(30), nullable=False, unique=True, index=True)
     password = db.Column(db.String(70), nullable=False)
     tokens = db.Column(db.Integer, default=50)
-    tokens_spent = db.Column(db.Integer, default=0)
-    rolls_done = db.Column(db.Integer, default=0)
+    tokens_spent = db.Column(db.Integer, default=0, index=True)
+    rolls_done = db.Column(db.Integer, default=0, index=True)
     last_daily_claim = db.Column(db.DateTime, default=datetime.utcnow)
     security_question = db.Column(db.String(200), nullable=True)
     security_answer_hash = db.Column(db.String(200), nullable=True)
-    battle_wins = db.Column(db.Integer, default=0)
+    battle_wins = db.Column(db.Integer, default=0, index=True)
     battle_losses = db.Column(db.Integer, default=0)
+    # Counters kept in step with user_heroes by update_collection_stats().
+    collection_size = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)
+    owns_goku = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    owns_creator = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    collection_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating = db.Column(db.Float, nullable=False, default=START_RATING, server_default=str(START_RATING), index=True)
+    # Set on every write, so each process's leaderboard refresher can pick up changed rows.
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True, index=True)
+    # The marketplace's player search is a case-insensitive prefix match on this.
+    __table_args__ = (db.Index('ix_user_username_lower', db.func.lower(username)),)
 
 
     heroes = db.relationship('Hero', secondary=user_heroes, backref="owners")
@@ -58,7 +115,7 @@ class Hero(db.Model):
     name = db.Column(db.String(30), nullable=False)
     description = db.Column(db.String(200), nullable=False)
     image = db.Column(db.String(1000), nullable=False)
-    rarity = db.Column(db.String(50), nullable=False)
+    rarity = db.Column(db.String(50), nullable=False, index=True)
     greek_type = db.Column(db.String(50), nullable=True)
     
     base_hp = db.Column(db.Integer, default=100)
@@ -66,6 +123,11 @@ class Hero(db.Model):
     base_defense = db.Column(db.Integer, default=5)
 
 
+class CatalogVersion(db.Model):
+    """A counter bumped whenever a cached catalog ("heroes", ...) changes, so every process reloads it."""
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 class Achievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
@@ -81,12 +143,19 @@ class Trade(db.Model):
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     requestedHero_id = db.Column(db.Integer, db.ForeignKey('hero.id'), nullable=False)
     status = db.Column(db.String(50), default="pending")
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     sender = db.relationship("User", foreign_keys=[sender_id])
     receiver = db.relationship("User", foreign_keys=[receiver_id])
     offered_hero = db.relationship("Hero", foreign_keys=[offeredHero_id])
     requested_hero = db.relationship("Hero", foreign_keys=[requestedHero_id])
 
+    # The dedup index leads with sender_id, so it also serves "my outgoing trades".
+    __table_args__ = (
+        db.Index('ix_trade_receiver_id_status', 'receiver_id', 'status'),
+        db.Index('ix_trade_sender_dedup', 'sender_id', 'receiver_id', 'offeredHero_id', 'requestedHero_id', 'status'),
+    )
+
 class LineUp(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     
@@ -99,6 +168,14 @@ class LineUp(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_queued = db.Column(db.Boolean, default=False)       
     is_challenger = db.Column(db.Boolean, default=False)    
+    # For challenger lineups: the queued lineup they claimed. The battle is pending until last_battle_winner is set.
+    opponent_lineup_id = db.Column(db.Integer, db.ForeignKey('line_up.id'), nullable=True)
+    # The owner's rating when the lineup entered the arena, and what its battle changed it by.
+    rating = db.Column(db.Float, nullable=True)
+    rating_change = db.Column(db.Float, nullable=True)
+    # Challenger lineups whose battle raised: how often it was tried, and whether it was given up on.
+    battle_attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    battle_failed = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     last_battle_log = db.Column(db.Text, nullable=True)
     last_battle_winner = db.Column(db.String(50), nullable=True)
@@ -109,6 +186,35 @@ class LineUp(db.Model):
     hero2 = db.relationship("Hero", foreign_keys=[hero_2])
     hero3 = db.relationship("Hero", foreign_keys=[hero_3])
 
+    __table_args__ = (
+        db.Index('ix_line_up_is_queued_timestamp', 'is_queued', 'timestamp'),
+        db.Index('ix_line_up_user_id_is_queued_timestamp', 'user_id', 'is_queued', 'timestamp'),
+        # Partial, so rewriting the ratings of past lineups doesn't touch it; the predicate matches is_(True).
+        db.Index('ix_line_up_queued_rating', 'rating', sqlite_where=db.text('is_queued IS 1')),
+    )
+
+class Battle(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    defender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    challenger_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    defender_lineup_id = db.Column(db.Integer, db.ForeignKey('line_up.id'), nullable=False, index=True)
+    challenger_lineup_id = db.Column(db.Integer, db.ForeignKey('line_up.id'), nullable=False, index=True)
+    winner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    seed = db.Column(db.Integer, nullable=True)
+    # snapshot_lineups() JSON; with the seed it regenerates the whole battle.
+    stats_snapshot = db.deferred(db.Column(db.Text, nullable=True))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    defender = db.relationship("User", foreign_keys=[defender_id])
+    challenger = db.relationship("User", foreign_keys=[challenger_id])
+    winner = db.relationship("User", foreign_keys=[winner_id])
+
+    def battle_log(self):
+        """The BattleLog regenerated from the seed and snapshot, or None for a battle stored without them."""
+        if self.seed is not None and self.stats_snapshot:
+            return replay_battle(self.stats_snapshot, self.seed).log
+        return None
+
 class CombatHero:
     def __init__(self, hero):
         self.id = hero.id
@@ -124,16 +230,41 @@ class CombatHero:
     def basehp(self):
         return self.base_hp
 
-def no_security_question_set():
-    users = User.query.all()
-    for user in users:
-        if not user.security_question or not user.security_answer_hash:
-            return render_template('set_security.html', user=user)
-        elif not user.battle_wins and not user.battle_losses:
-            user.battle_wins = 0
-            user.battle_losses = 0
-            db.session.commit()
-    return
+def owns_hero(user_id, hero_id) -> bool:
+    return db.session.query(db.exists().where(user_heroes.c.user_id == user_id, user_heroes.c.hero_id == hero_id)).scalar()
+
+def owned_hero_ids(user_id) -> set:
+    return set(db.session.scalars(db.select(user_heroes.c.hero_id).where(user_heroes.c.user_id == user_id)))
+
+def ever_owned_hero_ids(user_id) -> set:
+    return set(db.session.scalars(db.select(user_hero_history.c.hero_id).where(user_hero_history.c.user_id == user_id)))
+
+def grant_hero(user_id, hero_id) -> bool:
+    """Add an ownership row without loading the collection; False if a concurrent request already added it."""
+    return db.session.execute(
+        sqlite_insert(user_heroes).values(user_id=user_id, hero_id=hero_id).on_conflict_do_nothing()).rowcount == 1
+
+def record_hero_history(user_id, hero_id) -> bool:
+    return db.session.execute(
+        sqlite_insert(user_hero_history).values(user_id=user_id, hero_id=hero_id).on_conflict_do_nothing()).rowcount == 1
+
+def update_collection_stats(user_id, gained=(), lost=()):
+    """Apply heroes ``gained``/``lost`` in user_heroes to the user's counter columns, in the same transaction."""
+    values = {
+        "collection_size": User.collection_size + len(gained) - len(lost),
+        "collection_version": User.collection_version + 1,
+    }
+    flags = hero_catalog().special_flags
+    for hero_id in lost:
+        if hero_id in flags:
+            values[flags[hero_id]] = False
+    for hero_id in gained:
+        if hero_id in flags:
+            values[flags[hero_id]] = True
+    db.session.execute(db.update(User).where(User.id == user_id).values(**values).execution_options(synchronize_session=False))
+
+def no_security_question_set(user) -> bool:
+    return not user.security_question or not user.security_answer_hash
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -284,7 +415,6 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    no_security_question_set()
     today = datetime.utcnow().date()
     last_claim = current_user.last_daily_claim.date()
     if today > last_claim:
@@ -293,41 +423,110 @@ def dashboard():
         flash("You have claimed your daily 25 tokens!", "success")
         db.session.commit()
     user_heroes = current_user.heroes
-    return render_template('dashboard.html', user_heroes=user_heroes)
+    return render_template('dashboard.html', user_heroes=user_heroes,
+                           needs_security_question=no_security_question_set(current_user))
+
+MARKETPLACE_PAGE_SIZE = 24
+
+def parse_listing_cursor(cursor):
+    """Turn a ``"<user_id>:<hero_id>"`` cursor back into a key tuple."""
+    if not cursor:
+        return None
+    try:
+        user_id, hero_id = cursor.split(":")
+        return int(user_id), int(hero_id)
+    except ValueError:
+        return None
+
+def marketplace_listings(viewer_id, rarity=None, greek_type=None, search=None, after=None, limit=MARKETPLACE_PAGE_SIZE):
+    """One keyset-paginated page of other players' heroes, and the cursor for the next page (None on the last)."""
+    query = (db.select(user_heroes.c.user_id, user_heroes.c.hero_id, User.username,
+                       Hero.name, Hero.rarity, Hero.greek_type, Hero.image)
+             .join(User, User.id == user_heroes.c.user_id)
+             .join(Hero, Hero.id == user_heroes.c.hero_id)
+             .where(user_heroes.c.user_id != viewer_id))
+    if rarity:
+        query = query.where(Hero.rarity == rarity.lower())
+    if greek_type:
+        query = query.where(Hero.greek_type == greek_type)
+    if search:
+        # Players match on a name prefix, as a range so it seeks ix_user_username_lower;
+        # heroes anywhere in the name, resolved against the cached catalog.
+        search = search.lower()
+        username = db.func.lower(User.username)
+        hero_ids = [hero.id for hero in hero_catalog().heroes if search in hero.name.lower()]
+        query = query.where(db.or_(
+            db.and_(username >= search, username < search[:-1] + chr(ord(search[-1]) + 1)),
+            user_heroes.c.hero_id.in_(hero_ids)))
+    if after:
+        query = query.where(db.tuple_(user_heroes.c.user_id, user_heroes.c.hero_id) > after)
+    query = query.order_by(user_heroes.c.user_id, user_heroes.c.hero_id).limit(limit + 1)
+
+    rows = db.session.execute(query).all()
+    listings = [{
+        'owner': row.username,
+        'owner_id': row.user_id,
+        'hero': row.name,
+        'hero_id': row.hero_id,
+        'rarity': row.rarity,
+        'greek_type': row.greek_type,
+        'image': row.image
+    } for row in rows[:limit]]
+    next_cursor = f"{rows[limit - 1].user_id}:{rows[limit - 1].hero_id}" if len(rows) > limit else None
+    return listings, next_cursor
+
+def listing_filters():
+    return {
+        'rarity': request.args.get('rarity') or None,
+        'greek_type': request.args.get('greek_type') or None,
+        'search': (request.args.get('search') or '').strip() or None,
+    }
+
+# Users are joined in; heroes are fetched with one IN query so a hero that
+# appears in many trades (and its image) is loaded once.
+TRADE_LIST_OPTIONS = (
+    joinedload(Trade.sender),
+    joinedload(Trade.receiver),
+    selectinload(Trade.offered_hero),
+    selectinload(Trade.requested_hero),
+)
 
 @app.route('/trade')
 @login_required
+@query_budget(12)
 def trade():
-    other_users = []
-    all_users = User.query.filter(User.id != current_user.id).all()
-    for user in all_users:
-        for hero in user.heroes:
-            other_users.append({
-                'owner': user.username,
-                'hero': hero.name,
-                'hero_id': hero.id,
-                'owner_id': user.id,
-                'rarity': hero.rarity,
-                'image': hero.image
-            })
-    
+    filters = listing_filters()
+    other_users, next_cursor = marketplace_listings(current_user.id, **filters)
+    greek_types = db.session.scalars(
+        db.select(Hero.greek_type).where(Hero.greek_type.is_not(None)).distinct().order_by(Hero.greek_type)).all()
+
     user_heroes = current_user.heroes
-    incoming_trades = Trade.query.filter_by(receiver_id=current_user.id, status="pending").all()
-    outgoing_trades = Trade.query.filter_by(sender_id=current_user.id).all()
+    incoming_trades = Trade.query.options(*TRADE_LIST_OPTIONS).filter_by(receiver_id=current_user.id, status="pending").all()
+    outgoing_trades = Trade.query.options(*TRADE_LIST_OPTIONS).filter_by(sender_id=current_user.id).all()
 
     return render_template("trade.html", 
                          other_users=other_users, 
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         greek_types=greek_types,
                          user_heroes=user_heroes,
                          incoming_trades=incoming_trades,
                          outgoing_trades=outgoing_trades)
 
+@app.route('/trade/listings')
+@login_required
+@query_budget(3)
+def trade_listings():
+    listings, next_cursor = marketplace_listings(
+        current_user.id, after=parse_listing_cursor(request.args.get('after')), **listing_filters())
+    return jsonify(listings=listings, next=next_cursor)
+
 @app.route('/create_trade', methods=['POST'])
 @login_required
 def create_trade():
     receiver_id = int(request.form.get("receiver_id"))
     offered_hero_id = int(request.form.get("offered_hero_id"))
     requested_hero_id = int(request.form.get("requested_hero_id"))
-    receiverHasHero = False
 
     sender_hero = Hero.query.filter_by(id=offered_hero_id).first()
 
@@ -335,7 +534,7 @@ def create_trade():
         flash("This hero does not exist", "danger")
         return redirect(url_for('trade'))
     
-    if sender_hero not in current_user.heroes:
+    if not owns_hero(current_user.id, sender_hero.id):
         flash("You do not own this hero!", "danger")
         return redirect(url_for('trade'))
     
@@ -343,14 +542,7 @@ def create_trade():
         flash("You can't trade with yourself!", "danger")
         return redirect(url_for('trade'))
     
-    receiver = User.query.filter_by(id=receiver_id).first()
-    for hero in receiver.heroes:
-        if requested_hero_id == hero.id:
-            receiverHasHero = True
-            break
-        else:
-            pass
-    if not receiverHasHero:
+    if not owns_hero(receiver_id, requested_hero_id):
         flash("That user does not own that hero!", "danger")
         return redirect(url_for('trade'))
         
@@ -367,11 +559,101 @@ def create_trade():
     flash("The trade was sent successfully!", "success")
     return redirect(url_for("trade"))
     
+class TradeError(Exception):
+    pass
+
+def set_trade_status(trade_id, version, status) -> bool:
+    """Move a pending trade to ``status`` if nobody else has changed it since ``version`` was read."""
+    return db.session.execute(
+        db.update(Trade)
+        .where(Trade.id == trade_id, Trade.status == "pending", Trade.version == version)
+        .values(status=status, version=Trade.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+def cancel_trades_for_heroes(holdings, exclude_trade_id=None) -> int:
+    """Cancel pending trades that offer or request any (user_id, hero_id) in ``holdings``."""
+    conditions = []
+    for user_id, hero_id in holdings:
+        conditions.append(db.and_(Trade.sender_id == user_id, Trade.offeredHero_id == hero_id))
+        conditions.append(db.and_(Trade.receiver_id == user_id, Trade.requestedHero_id == hero_id))
+    query = db.update(Trade).where(Trade.status == "pending", db.or_(*conditions))
+    if exclude_trade_id is not None:
+        query = query.where(Trade.id != exclude_trade_id)
+    return db.session.execute(
+        query.values(status="cancelled", version=Trade.version + 1).execution_options(synchronize_session=False)
+    ).rowcount
+
+STALE_TRADE_BATCH = 500
+
+def sweep_stale_trades(batch_size=STALE_TRADE_BATCH) -> int:
+    """Cancel pending trades whose heroes changed hands, in batches committed one by one; returns how many."""
+    sender_missing = ~db.exists().where(user_heroes.c.user_id == Trade.sender_id,
+                                        user_heroes.c.hero_id == Trade.offeredHero_id)
+    receiver_missing = ~db.exists().where(user_heroes.c.user_id == Trade.receiver_id,
+                                          user_heroes.c.hero_id == Trade.requestedHero_id)
+    stale = db.and_(Trade.status == "pending", db.or_(sender_missing, receiver_missing))
+
+    total = 0
+    while True:
+        batch = db.select(Trade.id).where(stale).limit(batch_size).scalar_subquery()
+        cancelled = db.session.execute(
+            db.update(Trade)
+            .where(Trade.id.in_(batch), stale)
+            .values(status="cancelled", version=Trade.version + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        total += cancelled
+        if cancelled < batch_size:
+            break
+
+    app.logger.info("Stale trade sweep cancelled %s trades", total)
+    return total
+
+def execute_trade(trade) -> int:
+    """Swap the heroes of a pending trade; raises TradeError, or returns how many competing trades were cancelled."""
+    trade_id, version = trade.id, trade.version
+    moves = (
+        (trade.sender_id, trade.receiver_id, trade.offeredHero_id,
+         "The other user no longer owns that hero!", "You already own the hero they offered!"),
+        (trade.receiver_id, trade.sender_id, trade.requestedHero_id,
+         "You no longer own the hero they requested!", "The other user already owns the hero you would give them!"),
+    )
+
+    def abort(message):
+        db.session.rollback()
+        set_trade_status(trade_id, version, "cancelled")
+        db.session.commit()
+        raise TradeError(message)
+
+    if not set_trade_status(trade_id, version, "accepted"):
+        db.session.rollback()
+        raise TradeError("This trade no longer is available")
+
+    for giver_id, taker_id, hero_id, missing_message, duplicate_message in moves:
+        removed = db.session.execute(
+            user_heroes.delete().where(user_heroes.c.user_id == giver_id, user_heroes.c.hero_id == hero_id)
+        ).rowcount
+        if not removed:
+            abort(missing_message)
+        added = db.session.execute(
+            sqlite_insert(user_heroes).values(user_id=taker_id, hero_id=hero_id).on_conflict_do_nothing()
+        ).rowcount
+        if not added:
+            abort(duplicate_message)
+        update_collection_stats(giver_id, lost=[hero_id])
+        update_collection_stats(taker_id, gained=[hero_id])
+
+    cancelled = cancel_trades_for_heroes([(giver_id, hero_id) for giver_id, _, hero_id, _, _ in moves], trade_id)
+    db.session.commit()
+    app.logger.info("Trade %s executed, %s competing trades cancelled", trade_id, cancelled)
+    return cancelled
+
 @app.route('/accept_trade/<int:trade_id>', methods=["POST"])
 @login_required
 def accept_trade(trade_id):
     trade = Trade.query.filter_by(id=trade_id).first()
-    receiverHasHero = False
     
     if not trade:
         flash("This trade does not exist!", "error")
@@ -379,39 +661,21 @@ def accept_trade(trade_id):
     
     if current_user.id != trade.receiver_id:
         flash("You can't accept this trade!", "danger")
-        redirect(url_for('trade'))
+        return redirect(url_for('trade'))
 
     if trade.status != "pending":
         flash("This trade no longer is available", "error")
-        redirect(url_for('trade'))
-    
-    sender = User.query.get(trade.sender_id)
-
-    for hero in sender.heroes:
-        if trade.offeredHero_id == hero.id:
-            receiverHasHero = True
-            break
-        else:
-            pass
-    if not receiverHasHero:
-        flash("The other user no longer owns that hero!", "error")
-        trade.status = "cancelled"
-        db.session.commit()
         return redirect(url_for('trade'))
-        
-    
-    offered_hero = Hero.query.get(trade.offeredHero_id)
-    requested_hero = Hero.query.get(trade.requestedHero_id)
 
+    try:
+        execute_trade(trade)
+    except TradeError as error:
+        flash(str(error), "error")
+        return redirect(url_for('trade'))
 
-    current_user.heroes.remove(requested_hero)
-    sender.heroes.remove(offered_hero)
-
-    current_user.heroes.append(offered_hero)
-    sender.heroes.append(requested_hero)
-
-    trade.status = "accepted"
-    db.session.commit()
+    sender = db.session.get(User, trade.sender_id)
+    check_achievements(current_user, acquired_heroes=[trade.offered_hero.name])
+    check_achievements(sender, acquired_heroes=[trade.requested_hero.name])
 
     flash("The trade was completed successfully!", "info")
     return redirect(url_for('dashboard'))
@@ -433,7 +697,10 @@ def decline_trade(trade_id):
         flash("This trade no longer exists!", "error")
         return redirect(url_for('trade'))
 
-    trade.status = "declined"
+    if not set_trade_status(trade.id, trade.version, "declined"):
+        db.session.rollback()
+        flash("This trade no longer exists!", "error")
+        return redirect(url_for('trade'))
     db.session.commit()
     flash("The trade was declined.", "info")
     return redirect(url_for("trade"))
@@ -455,7 +722,10 @@ def cancel_trade(trade_id):
         flash("This trade no longer exists!", "error")
         return redirect(url_for('trade'))
 
-    trade.status = "cancelled"
+    if not set_trade_status(trade.id, trade.version, "cancelled"):
+        db.session.rollback()
+        flash("This trade no longer exists!", "error")
+        return redirect(url_for('trade'))
     db.session.commit()
     flash("The trade was successfully cancelled.", "info")
     return redirect(url_for('trade'))
@@ -463,247 +733,604 @@ def cancel_trade(trade_id):
 @app.route('/roll')
 @login_required
 def roll():
-    return render_template('roll.html')
+    return render_template('roll.html', roll_tables=ROLL_TABLES)
+
+def catalog_version(name) -> int:
+    """The stored version of a cached catalog, read at most once per app context (request, job or command)."""
+    versions = g.setdefault("catalog_versions", {})
+    if name not in versions:
+        versions[name] = db.session.scalar(db.select(CatalogVersion.version).where(CatalogVersion.name == name)) or 0
+    return versions[name]
+
+def bump_catalog_version(name):
+    """Record a catalog change in the current transaction; each process reloads on its next read."""
+    db.session.execute(sqlite_insert(CatalogVersion).values(name=name, version=1).on_conflict_do_update(
+        index_elements=[CatalogVersion.name], set_={"version": CatalogVersion.version + 1}))
+    g.pop("catalog_versions", None)
+
+class HeroCatalog:
+    """Every hero at the stored catalog ``version``, loaded once per process and grouped for rolling and the index pages."""
+
+    def __init__(self, heroes, version=0):
+        self.heroes = tuple(heroes)
+        self.version = version
+        by_rarity = defaultdict(list)
+        by_type = defaultdict(list)
+        for hero in sorted(self.heroes, key=lambda hero: hero.name):
+            by_rarity[hero.rarity].append(hero)
+            if hero.greek_type:
+                by_type[hero.greek_type].append(hero)
+        self.by_rarity = {rarity: tuple(heroes) for rarity, heroes in by_rarity.items()}
+        self.by_type = {greek_type: tuple(heroes) for greek_type, heroes in by_type.items()}
+        # Hero id -> the User flag column set while the hero is owned, e.g. "owns_goku".
+        self.special_flags = {hero.id: "owns_" + HERO_ACHIEVEMENTS[hero.name]
+                              for hero in self.heroes if hero.name in HERO_ACHIEVEMENTS}
+        # Card markup shared by every user, built on first use and dropped with the catalog.
+        self.fragments = {}
+
+_hero_catalog = None
+
+def hero_catalog() -> HeroCatalog:
+    """The cached HeroCatalog, reloaded when the stored "heroes" catalog version has moved on."""
+    global _hero_catalog
+    version = catalog_version("heroes")
+    catalog = _hero_catalog
+    if catalog is None or catalog.version != version:
+        with Session(db.engine, expire_on_commit=False) as session:
+            catalog = _hero_catalog = HeroCatalog(session.scalars(db.select(Hero).order_by(Hero.id)), version)
+    return catalog
+
+def invalidate_hero_catalog():
+    """Make every process reload the hero catalog; call it in the transaction that changes heroes."""
+    bump_catalog_version("heroes")
+
+FRAGMENT_CACHE_SIZE = 256
+_fragment_cache = OrderedDict()
+_fragment_cache_lock = threading.Lock()
+
+def cached_fragment(key, render) -> Markup:
+    """Rendered per-user HTML for ``key``, calling ``render()`` only on a miss; stale keys age out of the LRU."""
+    with _fragment_cache_lock:
+        value = _fragment_cache.get(key)
+        if value is not None:
+            _fragment_cache.move_to_end(key)
+            return value
+    value = Markup(render())
+    with _fragment_cache_lock:
+        _fragment_cache[key] = value
+        if len(_fragment_cache) > FRAGMENT_CACHE_SIZE:
+            _fragment_cache.popitem(last=False)
+    return value
+
+def catalog_fragment(catalog, name, build):
+    """``build()`` kept on ``catalog`` itself, so per-user fragments can never evict it."""
+    value = catalog.fragments.get(name)
+    if value is None:
+        value = catalog.fragments[name] = build()
+    return value
+
+def hero_index_cards(catalog) -> dict:
+    """Hero id -> the hero's index card markup for each ownership state ("owned", "seen", "locked")."""
+    def build():
+        return {hero.id: {state: Markup(render_template("hero_index_card.html", hero=hero,
+                                                        is_owned=state == "owned", ever_owned=state != "locked"))
+                          for state in ("owned", "seen", "locked")}
+                for hero in catalog.heroes}
+    return catalog_fragment(catalog, "hero_index_cards", build)
+
+def type_index_cards(catalog) -> dict:
+    """Hero id -> the card the type index shows for an owned hero, shared by every user."""
+    def build():
+        return {hero.id: Markup(render_template("type_index_card.html", hero=hero))
+                for heroes in catalog.by_type.values() for hero in heroes}
+    return catalog_fragment(catalog, "type_index_cards", build)
+
+def fingerprint(*parts) -> str:
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+
+def header_state():
+    """What header.html shows, so it can be part of a page's ETag."""
+    return current_user.id, current_user.username, current_user.tokens
+
+def conditional_page(etag_parts, render):
+    """Answer 304 when the client's ETag matches ``etag_parts``, else ``render()``."""
+    # Showing flashed messages pops them from the session, so those pages never get an ETag.
+    if session.get("_flashes"):
+        return make_response(render())
+    etag = fingerprint(*etag_parts)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 def rolling(chosen_rarity):
-    numHeroes = Hero.query.filter_by(rarity=chosen_rarity).count()
-    index = random.randint(0, numHeroes-1)
-    chosen_hero = Hero.query.filter_by(rarity=chosen_rarity).offset(index).first()
-    return chosen_hero
+    chosen_hero = random.choice(hero_catalog().by_rarity[chosen_rarity])
+    # The pooled copy is detached; merging without a load attaches it to this request's session with no SELECT.
+    return db.session.merge(chosen_hero, load=False)
+
 
+MAX_ROLLS_PER_REQUEST = 10
+
+def roll_once(roll_type):
+    chosen_rarity = ROLL_TABLES[roll_type].roll()
+    return rolling(chosen_rarity), chosen_rarity
 
 @app.route('/perform_roll', methods=['POST'])
 @login_required
 def perform_roll():
     roll_type = request.form.get('roll_type')
-    
-    if roll_type == "basic":
-        roll = random.randint(1, 100)
-        if roll <= 50:
-            chosen_rarity = "common"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 51 and roll <= 80:
-            chosen_rarity = "rare"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 81 and roll <= 95:
-            chosen_rarity = "epic"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 96:
-            chosen_rarity = "legendary"
-            chosen_hero = rolling(chosen_rarity)
-        current_user.tokens -= 10
-        current_user.tokens_spent += 10
-    
-    elif roll_type == "premium":
-        roll = random.randint(1, 100)
-        if roll <= 20:
-            chosen_rarity = "common"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 21 and roll <= 65:
-            chosen_rarity = "rare"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 66 and roll <= 90:
-            chosen_rarity = "epic"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 91:
-            chosen_rarity = "legendary"
-            chosen_hero = rolling(chosen_rarity)
-        current_user.tokens -= 25
-        current_user.tokens_spent += 25
-        
-    elif roll_type == "legendary":
-        roll = random.randint(1, 100)
-        if roll <= 5:
-            chosen_rarity = "common"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 6 and roll <= 40:
-            chosen_rarity = "rare" 
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 41 and roll <= 75:
-            chosen_rarity = "epic"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll >= 76 and roll <= 99:
-            chosen_rarity = "legendary"
-            chosen_hero = rolling(chosen_rarity)
-        elif roll == 100:
-            chosen_rarity = "godly"
-            chosen_hero = rolling(chosen_rarity)
-        current_user.tokens -= 50
-        current_user.tokens_spent += 50
-    
-    flash(f"You got {chosen_hero.name}! Which is a {chosen_hero.rarity}.", "success")
-    current_user.rolls_done += 1
-    if chosen_hero.id not in [hero.id for hero in current_user.heroes]:
-        current_user.heroes.append(chosen_hero)
-    if chosen_hero.id not in [hero.id for hero in current_user.heroes_history]:
-        current_user.heroes_history.append(chosen_hero)
-        flash("New hero added to your collection!", "info")
-        db.session.commit()
-    
+    # The single-roll buttons send no count. Not type=int: that turns a malformed count into the default.
+    try:
+        roll_count = int(request.form.get('roll_count', 1))
+    except ValueError:
+        roll_count = 0
+
+    if roll_type not in ROLL_TABLES:
+        flash("That roll type does not exist.", "warning")
+        return redirect(url_for('roll'))
+
+    if not 1 <= roll_count <= MAX_ROLLS_PER_REQUEST:
+        flash(f"You can roll between 1 and {MAX_ROLLS_PER_REQUEST} times at once.", "warning")
+        return redirect(url_for('roll'))
+
+    cost = ROLL_TABLES[roll_type].cost * roll_count
+    # Charged in one conditional UPDATE so simultaneous rolls can't both pass the balance check.
+    charged = db.session.execute(
+        db.update(User)
+        .where(User.id == current_user.id, User.tokens >= cost)
+        .values(tokens=User.tokens - cost, tokens_spent=User.tokens_spent + cost, rolls_done=User.rolls_done + roll_count)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not charged:
+        db.session.rollback()
+        flash("You do not have enough tokens for that roll.", "warning")
+        return redirect(url_for('roll'))
+
+    owned_ids = owned_hero_ids(current_user.id)
+    ever_owned_ids = ever_owned_hero_ids(current_user.id)
+    rolled = []
+    gained = []
+    new_heroes = 0
+    refund = 0
+
+    for _ in range(roll_count):
+        chosen_hero, chosen_rarity = roll_once(roll_type)
+        rolled.append(chosen_hero)
+        # Only rows this request actually inserted count, so a hero granted by a concurrent roll is a duplicate here.
+        if chosen_hero.id not in owned_ids and grant_hero(current_user.id, chosen_hero.id):
+            gained.append(chosen_hero.id)
+        owned_ids.add(chosen_hero.id)
+        if chosen_hero.id not in ever_owned_ids and record_hero_history(current_user.id, chosen_hero.id):
+            new_heroes += 1
+        else:
+            refund += ROLL_TABLES[roll_type].duplicate_refunds[chosen_rarity]
+        ever_owned_ids.add(chosen_hero.id)
+
+    if gained:
+        update_collection_stats(current_user.id, gained=gained)
+    if refund:
+        db.session.execute(db.update(User).where(User.id == current_user.id).values(tokens=User.tokens + refund)
+                           .execution_options(synchronize_session=False))
+    db.session.commit()
+
+    if roll_count == 1:
+        flash(f"You got {rolled[0].name}! Which is a {rolled[0].rarity}.", "success")
+        if new_heroes:
+            flash("New hero added to your collection!", "info")
+        else:
+            flash("You got a duplicate!", "dupe")
+            flash(f"You got {refund} tokens!", "dupe")
     else:
-        flash("You got a duplicate!", "dupe")
-        if chosen_rarity == "common":
-            current_user.tokens += 5
-            flash("You got 5 tokens!", "dupe")
-        elif chosen_rarity == "rare":
-            current_user.tokens += 10
-            flash("You got 10 tokens!", "dupe")
-        elif chosen_rarity == "epic":
-            current_user.tokens += 15
-            flash("You got 15 tokens!", "dupe")
-        elif chosen_rarity == "legendary":
-            current_user.tokens += 25
-            flash("You got 25 tokens!", "dupe")
-        elif chosen_rarity == "godly":
-            current_user.tokens += 50
-            flash("You got 50 tokens!", "dupe")
-        db.session.commit()
-    check_achievements()
+        flash(f"You got {', '.join(hero.name for hero in rolled)}!", "success")
+        if new_heroes:
+            flash(f"{new_heroes} new heroes added to your collection!", "info")
+        if new_heroes < roll_count:
+            flash(f"You got {roll_count - new_heroes} duplicates and {refund} tokens back!", "dupe")
+    check_achievements(current_user, {
+        "roll_count": current_user.rolls_done,
+        "tokens_spent": current_user.tokens_spent,
+        "hero_collection": len(owned_ids),
+    }, [hero.name for hero in rolled])
     return redirect(url_for('roll'))
 
 @app.route('/achievements')
 @login_required
 def achievements():
-    check_achievements()
-    all_achievements = Achievement.query.order_by(Achievement.type, Achievement.value, Achievement.id).all()
-    user_achievements = current_user.achievements
-    user_achievement_ids = {a.id for a in user_achievements}
-    achievements_by_type = defaultdict(list)
-
-    def current_value_for(achievement):
-        if achievement.type == "hero_collection":
-            return len(current_user.heroes)
-        if achievement.type == "roll_count":
-            return current_user.rolls_done
-        if achievement.type == "tokens_spent":
-            return current_user.tokens_spent
-        if achievement.type == "battle_wins":
-            return current_user.battle_wins
-        if achievement.type == "goku":
-            return 1 if any(hero.name == "Goku" for hero in current_user.heroes) else 0
-        if achievement.type == "creator":
-            return 1 if any(hero.name == "The Creator" for hero in current_user.heroes) else 0
-        return 0
-
-    for achievement in all_achievements:
-        is_unlocked = achievement.id in user_achievement_ids
-        target_value = achievement.value or 0
-        if achievement.type in ("goku", "creator") and target_value == 0:
-            target_value = 1
-
-        current_value = current_value_for(achievement)
-        progress_percent = 0
-        if target_value > 0:
-            progress_percent = int((current_value / target_value) * 100)
-        if progress_percent > 100:
-            progress_percent = 100
-        if is_unlocked:
-            progress_percent = 100
-
-        achievements_by_type[achievement.type].append({
-            "achievement": achievement,
-            "is_unlocked": is_unlocked,
-            "target_value": target_value,
-            "current_value": current_value,
-            "progress_percent": progress_percent
-        })
-
-    newly_unlocked_achievements = []
-    ordered_types = sorted(achievements_by_type.keys())
-    
-    return render_template('achievement.html',
-        all_achievements=all_achievements,
-        user_achievements=user_achievements,
-        user_achievement_ids=user_achievement_ids,
-        newly_unlocked_achievements=newly_unlocked_achievements,
-        achievements_by_type=achievements_by_type,
-        ordered_types=ordered_types
-    )
+    counters = achievement_counters(current_user)
+    sync_achievements(current_user, counters)
+    tracker = achievement_tracker()
+    user_achievement_ids = set(db.session.scalars(
+        db.select(user_achievements.c.achievement_id).where(user_achievements.c.user_id == current_user.id)))
+    key = ("achievement_list", tracker.version, fingerprint(sorted(counters.items()), sorted(user_achievement_ids)))
+
+    def render_list():
+        achievements_by_type = defaultdict(list)
+        for achievement in tracker.achievements:
+            is_unlocked = achievement.id in user_achievement_ids
+            target_value = achievement.value or 0
+            if achievement.type in ("goku", "creator") and target_value == 0:
+                target_value = 1
+
+            current_value = counters.get(achievement.type, 0)
+            progress_percent = 0
+            if target_value > 0:
+                progress_percent = int((current_value / target_value) * 100)
+            if progress_percent > 100:
+                progress_percent = 100
+            if is_unlocked:
+                progress_percent = 100
+
+            achievements_by_type[achievement.type].append({
+                "achievement": achievement,
+                "is_unlocked": is_unlocked,
+                "target_value": target_value,
+                "current_value": current_value,
+                "progress_percent": progress_percent
+            })
+        return render_template('achievement_list.html',
+            achievements_by_type=achievements_by_type,
+            ordered_types=sorted(achievements_by_type.keys())
+        )
 
-def check_achievements():
-    all_achievements = Achievement.query.all()
-    amount_of_heroes = len(current_user.heroes)
+    def render():
+        return render_template('achievement.html',
+            all_achievements=tracker.achievements,
+            user_achievement_ids=user_achievement_ids,
+            achievements_html=cached_fragment(key, render_list)
+        )
+    return conditional_page((key, header_state()), render)
+
+HERO_ACHIEVEMENTS = {"Goku": "goku", "The Creator": "creator"}
+MAX_TRACKED_USERS = 10000
+
+class AchievementTracker:
+    """Achievements sorted by threshold, plus each seen user's unlocks and next locked threshold per type."""
+
+    def __init__(self, achievements, db_version=0):
+        self.db_version = db_version
+        self.achievements = tuple(sorted(achievements, key=lambda achievement: (achievement.type, achievement.value or 0, achievement.id)))
+        contents = [(achievement.id, achievement.name, achievement.description, achievement.type,
+                     achievement.value, achievement.difficulty) for achievement in self.achievements]
+        self.version = format(zlib.crc32(repr(contents).encode()), "08x")
+        by_type = defaultdict(list)
+        for achievement in self.achievements:
+            threshold = achievement.value or 0
+            if achievement.type in HERO_ACHIEVEMENTS.values():
+                threshold = max(threshold, 1)
+            by_type[achievement.type].append((threshold, achievement.id))
+        self.thresholds = {achievement_type: sorted(entries) for achievement_type, entries in by_type.items()}
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user_state(self, user_id):
+        """The user's (unlocked, pointers) pair; call with ``_lock`` held."""
+        state = self._users.get(user_id)
+        if state is not None:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _load_user_state(self, user_id):
+        unlocked = set(db.session.scalars(db.select(user_achievements.c.achievement_id).where(user_achievements.c.user_id == user_id)))
+        pointers = {}
+        for achievement_type, thresholds in self.thresholds.items():
+            pointer = 0
+            while pointer < len(thresholds) and thresholds[pointer][1] in unlocked:
+                pointer += 1
+            pointers[achievement_type] = pointer
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep whichever got in first.
+            state = self._users.setdefault(user_id, (unlocked, pointers))
+            self._users.move_to_end(user_id)
+            if len(self._users) > MAX_TRACKED_USERS:
+                self._users.popitem(last=False)
+        return state
+
+    def record(self, user_id, achievement_type, value) -> bool:
+        thresholds = self.thresholds.get(achievement_type)
+        if not thresholds:
+            return False
+        with self._lock:
+            state = self._user_state(user_id)
+        if state is None:
+            # Queried outside the lock so one user's first visit doesn't hold up everyone else.
+            state = self._load_user_state(user_id)
+        crossed = []
+        with self._lock:
+            unlocked, pointers = state
+            pointer = pointers[achievement_type]
+            while pointer < len(thresholds) and value >= thresholds[pointer][0]:
+                achievement_id = thresholds[pointer][1]
+                if achievement_id not in unlocked:
+                    unlocked.add(achievement_id)
+                    crossed.append(achievement_id)
+                pointer += 1
+            pointers[achievement_type] = pointer
+        unlocked_any = False
+        for achievement_id in crossed:
+            # Another worker may have unlocked it already; the primary key makes this a no-op then.
+            result = db.session.execute(sqlite_insert(user_achievements).values(user_id=user_id, achievement_id=achievement_id).on_conflict_do_nothing())
+            unlocked_any |= result.rowcount > 0
+        return unlocked_any
+
+_achievement_tracker = None
+
+def achievement_tracker():
+    """The cached AchievementTracker, rebuilt when the stored "achievements" catalog version has moved on."""
+    global _achievement_tracker
+    version = catalog_version("achievements")
+    tracker = _achievement_tracker
+    if tracker is None or tracker.db_version != version:
+        with Session(db.engine, expire_on_commit=False) as session:
+            tracker = _achievement_tracker = AchievementTracker(session.scalars(db.select(Achievement)), version)
+    return tracker
+
+def invalidate_achievement_tracker():
+    """Make every process rebuild its tracker; call it in the transaction that changes achievements."""
+    bump_catalog_version("achievements")
+
+def check_achievements(user, counters=None, acquired_heroes=()):
+    """Unlock achievements reached by the new ``counters`` values or the just-received ``acquired_heroes``."""
+    tracker = achievement_tracker()
     obtained_any = False
-
-    def unlock(achievement):
-        nonlocal obtained_any
-        current_user.achievements.append(achievement)
-        obtained_any = True
-
-    for achievement in all_achievements:
-        if achievement in current_user.achievements:
-            continue
-
-        if achievement.type == "hero_collection":
-            if amount_of_heroes >= achievement.value:
-                unlock(achievement)
-
-        elif achievement.type == "roll_count":
-            if current_user.rolls_done >= achievement.value:
-                unlock(achievement)
-
-        elif achievement.type == "tokens_spent":
-            if current_user.tokens_spent >= achievement.value:
-                unlock(achievement)
-
-        elif achievement.type == "goku":
-            if any(hero.name == "Goku" for hero in current_user.heroes):
-                unlock(achievement)
-        
-        elif achievement.type == "creator":
-            if any(hero.name == "The Creator" for hero in current_user.heroes):
-                unlock(achievement)
-        
-        elif achievement.type == "battle_wins":
-            if current_user.battle_wins >= achievement.value:
-                unlock(achievement)
+    for achievement_type, value in (counters or {}).items():
+        obtained_any |= tracker.record(user.id, achievement_type, value)
+    for hero_name in acquired_heroes:
+        if hero_name in HERO_ACHIEVEMENTS:
+            obtained_any |= tracker.record(user.id, HERO_ACHIEVEMENTS[hero_name], 1)
 
     if obtained_any:
         db.session.commit()
-        flash("You have unlocked an achievement!", "success")
-
-    return
-
-                
-    
+        if has_request_context() and user.id == current_user.id:
+            flash("You have unlocked an achievement!", "success")
+    return obtained_any
+
+def achievement_counters(user) -> dict:
+    """The user's current value for every achievement type, read from the counter columns."""
+    return {
+        "hero_collection": user.collection_size,
+        "roll_count": user.rolls_done,
+        "tokens_spent": user.tokens_spent,
+        "battle_wins": user.battle_wins or 0,
+        "goku": int(user.owns_goku),
+        "creator": int(user.owns_creator),
+    }
+
+def sync_achievements(user, counters=None):
+    """Run every achievement type against the user's current totals, e.g. after new achievements were added."""
+    return check_achievements(user, counters or achievement_counters(user))
 
 @app.route('/hero_index', methods=['GET'])
 @login_required
 def hero_index():
-    user_heroes = current_user.heroes
-    user_hero_history = current_user.heroes_history
-    all_heroes = Hero.query.all()
-    return render_template("hero_index.html", user_heroes=user_heroes, all_heroes=all_heroes, user_hero_history=user_hero_history)
+    catalog = hero_catalog()
+
+    def render():
+        owned_ids = owned_hero_ids(current_user.id)
+        return render_template("hero_index.html",
+                               heroes_by_rarity=catalog.by_rarity,
+                               cards=hero_index_cards(catalog),
+                               total_heroes=len(catalog.heroes),
+                               owned_ids=owned_ids,
+                               ever_owned_ids=ever_owned_hero_ids(current_user.id))
+    return conditional_page(("hero_index", catalog.version, current_user.id, current_user.collection_version, header_state()), render)
 
 @app.route('/type_index', methods=['GET'])
 @login_required
 def type_index():
-    user_heroes = current_user.heroes
-    all_heroes = Hero.query.all()
-    greek_types = set(hero.greek_type for hero in all_heroes if hero.greek_type)
-    return render_template("type_index.html", user_heroes=user_heroes, all_heroes=all_heroes, greek_types=greek_types)
+    catalog = hero_catalog()
+
+    def render():
+        owned_ids = owned_hero_ids(current_user.id)
+        user_heroes_by_type = {greek_type: [hero for hero in heroes if hero.id in owned_ids]
+                               for greek_type, heroes in catalog.by_type.items()}
+        return render_template("type_index.html",
+                               user_heroes_by_type=user_heroes_by_type,
+                               cards=type_index_cards(catalog),
+                               owned_count=len(owned_ids))
+    return conditional_page(("type_index", catalog.version, current_user.id, current_user.collection_version, header_state()), render)
+
+MAX_QUEUED_LINEUPS = 3
+MATCH_CLAIM_ATTEMPTS = 5
+# Rating bands tried in turn when looking for an opponent; None takes anyone.
+MATCH_RATING_SPREADS = (100, 250, 500, None)
+
+def lineup_heroes_loaded():
+    return (joinedload(LineUp.hero1), joinedload(LineUp.hero2), joinedload(LineUp.hero3))
+
+def opponent_queue(user_id, rating=None, spread=None):
+    """Lineups posted by other players, longest-waiting first, optionally within ``spread`` rating points."""
+    query = LineUp.query.filter(LineUp.is_queued.is_(True), LineUp.user_id != user_id)
+    if spread is not None:
+        query = query.filter(LineUp.rating.between(rating - spread, rating + spread))
+    return query.order_by(LineUp.timestamp, LineUp.id)
+
+def queued_lineup_count(user_id) -> int:
+    return LineUp.query.filter_by(user_id=user_id, is_queued=True).count()
+
+def claim_lineup(lineup_id, user_id=None) -> bool:
+    """Take a lineup off the queue. The conditional UPDATE lets only one request win it."""
+    query = db.update(LineUp).where(LineUp.id == lineup_id, LineUp.is_queued.is_(True))
+    if user_id is not None:
+        query = query.where(LineUp.user_id == user_id)
+    return db.session.execute(
+        query.values(is_queued=False).execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+def match_candidate(user_id, rating):
+    """The longest-waiting lineup in the narrowest rating band that has one."""
+    for spread in MATCH_RATING_SPREADS:
+        candidate = opponent_queue(user_id, rating, spread).options(*lineup_heroes_loaded()).first()
+        if candidate is not None:
+            return candidate
+    return None
+
+def find_match(user_id, rating):
+    """Claim the closest-rated waiting lineup from another player, or None if the queue is empty."""
+    # SQLite has no SELECT ... FOR UPDATE, so a claim lost to another challenger moves on to the next lineup.
+    for _ in range(MATCH_CLAIM_ATTEMPTS):
+        candidate = match_candidate(user_id, rating)
+        if candidate is None:
+            return None
+        if claim_lineup(candidate.id):
+            return candidate
+    return None
+
+BATTLE_WORKERS = 4
+battle_pool = ThreadPoolExecutor(max_workers=BATTLE_WORKERS, thread_name_prefix="battle")
+
+def resolve_battle(challenger_lineup_id) -> bool:
+    """Fight a challenger lineup against the one it claimed; False if another resolver got there first."""
+    challenger = LineUp.query.options(*lineup_heroes_loaded()).filter_by(id=challenger_lineup_id).first()
+    if challenger is None or challenger.last_battle_winner or challenger.battle_failed:
+        return False
+    defender = LineUp.query.options(*lineup_heroes_loaded()).filter_by(id=challenger.opponent_lineup_id).first()
+    defender_owner = db.session.get(User, defender.user_id)
+    challenger_owner = db.session.get(User, challenger.user_id)
+
+    team_a = [CombatHero(hero) for hero in (defender.hero1, defender.hero2, defender.hero3)]
+    team_b = [CombatHero(hero) for hero in (challenger.hero1, challenger.hero2, challenger.hero3)]
+    seed = new_battle_seed()
+    raw_result = simulate_battle(team_a, team_b, defender_owner.username, challenger_owner.username, keep_log=False, seed=seed)
+    if raw_result.winner == defender_owner.username:
+        winner, loser = defender_owner, challenger_owner
+    else:
+        winner, loser = challenger_owner, defender_owner
+
+    battle = Battle(
+        defender_id=defender_owner.id,
+        challenger_id=challenger_owner.id,
+        defender_lineup_id=defender.id,
+        challenger_lineup_id=challenger.id,
+        winner_id=winner.id,
+        seed=seed,
+        stats_snapshot=snapshot_lineups(team_a, team_b, defender_owner.username, challenger_owner.username)
+    )
+    db.session.add(battle)
+    db.session.flush()
+
+    change = rating_change(winner.rating, loser.rating)
+    challenger_change = change if winner is challenger_owner else -change
+
+    result = {
+        "last_battle_winner": winner.username,
+        "last_battle_loser": loser.username,
+        "last_battle_unseen": True,
+    }
+    claimed = db.session.execute(
+        db.update(LineUp)
+        .where(LineUp.id == challenger.id, LineUp.last_battle_winner.is_(None), LineUp.battle_failed.is_(False))
+        .values(**result, rating_change=challenger_change)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return False
+    for column, value in result.items():
+        setattr(defender, column, value)
+    defender.rating_change = -challenger_change
+
+    # Increment in SQL so battles finishing at the same time for one player don't overwrite each other.
+    winner.battle_wins = User.battle_wins + 1
+    loser.battle_losses = User.battle_losses + 1
+    winner.tokens = User.tokens + 15
+    loser.tokens = User.tokens + 5
+    winner.rating = User.rating + change
+    loser.rating = User.rating - change
+    db.session.commit()
+    check_achievements(winner, {"battle_wins": winner.battle_wins})
+    return True
+
+MAX_BATTLE_ATTEMPTS = 3
+BATTLE_RETRY_SECONDS = 1
+
+def record_battle_failure(challenger_lineup_id) -> bool:
+    """Count a failed battle attempt and return whether to retry; the last one fails the challenger and requeues its opponent."""
+    db.session.execute(
+        db.update(LineUp)
+        .where(LineUp.id == challenger_lineup_id, LineUp.last_battle_winner.is_(None))
+        .values(battle_attempts=LineUp.battle_attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    challenger = db.session.get(LineUp, challenger_lineup_id, populate_existing=True)
+    if challenger is None or challenger.last_battle_winner or challenger.battle_failed:
+        db.session.commit()
+        return False
+    if challenger.battle_attempts < MAX_BATTLE_ATTEMPTS:
+        db.session.commit()
+        return True
+    failed = db.session.execute(
+        db.update(LineUp)
+        .where(LineUp.id == challenger_lineup_id, LineUp.last_battle_winner.is_(None), LineUp.battle_failed.is_(False))
+        .values(battle_failed=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if failed:
+        db.session.execute(
+            db.update(LineUp)
+            .where(LineUp.id == challenger.opponent_lineup_id, LineUp.last_battle_winner.is_(None))
+            .values(is_queued=True)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return False
+
+def run_battle_job(challenger_lineup_id) -> bool:
+    """Resolve one battle, retrying it a few times if it raises; see record_battle_failure."""
+    with app.app_context():
+        while True:
+            try:
+                return resolve_battle(challenger_lineup_id)
+            except Exception:
+                app.logger.exception("Battle for lineup %s failed", challenger_lineup_id)
+                db.session.rollback()
+                if not record_battle_failure(challenger_lineup_id):
+                    return False
+            time.sleep(BATTLE_RETRY_SECONDS)
+
+def battle_result_page(battle_result, battle_log):
+    team_a = team_b = None
+    # Logs stored as plain text before BattleLog existed carry no team data.
+    if isinstance(battle_log, BattleLog):
+        team_a = {
+            "label": "Posted Lineup",
+            "owner": battle_log.team_names[TEAM_A],
+            "heroes": battle_log.team_state(TEAM_A)
+        }
+        team_b = {
+            "label": "Challenger",
+            "owner": battle_log.team_names[TEAM_B],
+            "heroes": battle_log.team_state(TEAM_B)
+        }
+    return render_template("battle_result.html", battle_result=battle_result, battle_log=battle_log, team_a=team_a, team_b=team_b)
+
+def render_battle_result(lineup):
+    # A lineup fights once, as defender or challenger; older lineups only have the text log.
+    battle = (Battle.query.filter(db.or_(Battle.defender_lineup_id == lineup.id, Battle.challenger_lineup_id == lineup.id))
+              .order_by(Battle.id.desc()).first())
+    if battle:
+        battle_log = battle.battle_log() or []
+    else:
+        battle_log = load_battle_log(lineup.last_battle_log)
+    return battle_result_page(BattleResult(lineup.last_battle_winner, lineup.last_battle_loser, battle_log), battle_log)
 
 @app.route("/arena", methods=['GET', 'POST'])
 @login_required
+@query_budget(20)
 def arena():
-    roster = list(current_user.heroes)
-    queued_lineup = LineUp.query.filter_by(is_queued=True).order_by(LineUp.timestamp.desc()).first()
-    queued_owner = User.query.get(queued_lineup.user_id) if queued_lineup else None
-    queued_heroes = [queued_lineup.hero1, queued_lineup.hero2, queued_lineup.hero3] if queued_lineup else []
-    users_queued_lineups = LineUp.query.filter_by(is_queued=False, user_id=current_user.id).order_by(LineUp.timestamp.desc()).first()
-
-    if users_queued_lineups and users_queued_lineups.last_battle_unseen:
-        battle_log = []
-        if users_queued_lineups.last_battle_log:
-            battle_log = users_queued_lineups.last_battle_log.split("\n")
-        battle_result = BattleResult(
-            users_queued_lineups.last_battle_winner,
-            users_queued_lineups.last_battle_loser,
-            battle_log
-        )
-        users_queued_lineups.last_battle_unseen = False
+    # Results for lineups that were challenged while their owner was away are shown on the next visit.
+    unseen_lineup = None
+    if request.method == 'GET':
+        unseen_lineup = (LineUp.query.filter_by(user_id=current_user.id, is_queued=False, last_battle_unseen=True)
+                         .order_by(LineUp.timestamp).first())
+
+    if unseen_lineup:
+        unseen_lineup.last_battle_unseen = False
         db.session.commit()
-        return render_template("battle_result.html", battle_result=battle_result, battle_log=battle_log, team_a=None, team_b=None)
+        return render_battle_result(unseen_lineup)
             
 
     if request.method == 'POST':
@@ -720,16 +1347,10 @@ def arena():
                 flash("Use different heroes in each slot.", "warning")
                 return redirect(url_for('arena'))
 
-            owned_ids = {hero.id for hero in roster}
-            if not set(hero_ids).issubset(owned_ids):
+            if not set(hero_ids).issubset(owned_hero_ids(current_user.id)):
                 flash("You can only queue heroes you own.", "danger")
                 return redirect(url_for('arena'))
 
-            if LineUp.query.filter_by(is_queued=True).first():
-                flash("There is already a lineup queued in the arena! Challenge them or wait!", "warning")
-                return redirect(url_for('arena'))
-
-            LineUp.query.filter_by(is_queued=True).update({"is_queued": False})
             new_lineup = LineUp(
                 user_id=current_user.id,
                 hero_1=hero_ids[0],
@@ -737,18 +1358,29 @@ def arena():
                 hero_3=hero_ids[2],
                 is_queued=True,
                 is_challenger=False,
+                rating=current_user.rating,
                 timestamp=datetime.utcnow()
             )
             db.session.add(new_lineup)
+            db.session.flush()
+            # Counted after the insert so two simultaneous posts cannot both slip under the limit.
+            if queued_lineup_count(current_user.id) > MAX_QUEUED_LINEUPS:
+                db.session.rollback()
+                flash(f"You already have {MAX_QUEUED_LINEUPS} lineups waiting in the arena!", "warning")
+                return redirect(url_for('arena'))
             db.session.commit()
             flash("Your lineup is now waiting in the arena.", "success")
             return redirect(url_for('arena'))
 
-        elif intent == 'challenge':
-            if not queued_lineup:
-                flash("No lineup is currently queued to challenge.", "warning")
-                return redirect(url_for('arena'))
+        elif intent == 'withdraw':
+            if claim_lineup(request.form.get('lineup_id', type=int), current_user.id):
+                db.session.commit()
+                flash("Your lineup has left the arena.", "info")
+            else:
+                flash("That lineup is no longer waiting in the arena.", "warning")
+            return redirect(url_for('arena'))
 
+        elif intent == 'challenge':
             challenger_ids = [request.form.get('team_b_hero1'), request.form.get('team_b_hero2'), request.form.get('team_b_hero3')]
             if not all(challenger_ids):
                 flash("Select three heroes to challenge with.", "warning")
@@ -759,93 +1391,319 @@ def arena():
                 flash("Use different heroes in each challenger slot.", "warning")
                 return redirect(url_for('arena'))
 
-            owned_ids = {hero.id for hero in roster}
-            if not set(challenger_ids).issubset(owned_ids):
+            if not set(challenger_ids).issubset(owned_hero_ids(current_user.id)):
                 flash("You can only challenge with heroes you own.", "danger")
                 return redirect(url_for('arena'))
 
-            team_a_models = [queued_lineup.hero1, queued_lineup.hero2, queued_lineup.hero3]
-            if not all(team_a_models):
-                flash("The queued lineup is incomplete.", "warning")
-                return redirect(url_for('arena'))
-
-            team_b_models = [Hero.query.get(hid) for hid in challenger_ids]
+            challenger_heroes = {hero.id: hero for hero in Hero.query.filter(Hero.id.in_(challenger_ids))}
+            team_b_models = [challenger_heroes.get(hid) for hid in challenger_ids]
             if not all(team_b_models):
                 flash("One of the selected challenger heroes could not be found.", "danger")
                 return redirect(url_for('arena'))
 
-            team_a = [CombatHero(hero) for hero in team_a_models]
-            team_b = [CombatHero(hero) for hero in team_b_models]
-            raw_result = simulate_battle(team_a, team_b, queued_owner.username, current_user.username)
+            queued_lineup = find_match(current_user.id, current_user.rating)
+            if not queued_lineup:
+                flash("No other lineups are waiting in the arena right now.", "warning")
+                return redirect(url_for('arena'))
 
-            winner_name = queued_owner.username if raw_result.winner == queued_owner.username else current_user.username
-            loser_name = current_user.username if raw_result.winner == queued_owner.username else queued_owner.username
-            result = BattleResult(winner_name, loser_name, raw_result.log)
+            team_a_models = [queued_lineup.hero1, queued_lineup.hero2, queued_lineup.hero3]
+            if not all(team_a_models):
+                # Keep the claim so a broken lineup drops out of the queue.
+                db.session.commit()
+                flash("The queued lineup is incomplete.", "warning")
+                return redirect(url_for('arena'))
 
-            if winner_name == queued_owner.username:
-                queued_owner.battle_wins += 1
-                current_user.battle_losses += 1
-                queued_owner.tokens += 15
-                current_user.tokens += 5
-            else:
-                current_user.battle_wins += 1
-                queued_owner.battle_losses += 1
-                queued_owner.tokens += 5
-                current_user.tokens += 15
-
-            queued_lineup.last_battle_log = "\n".join(raw_result.log)
-            queued_lineup.last_battle_winner = winner_name
-            queued_lineup.last_battle_loser = loser_name
-            queued_lineup.last_battle_unseen = True
-
-            team_a_state = [{
-                "name": hero.name,
-                "greek_type": hero.greek_type,
-                "hp": max(hero.health, 0),
-                "base_hp": hero.base_hp,
-                "attack": hero.attack,
-                "defense": hero.defense
-            } for hero in team_a]
-
-            team_b_state = [{
-                "name": hero.name,
-                "greek_type": hero.greek_type,
-                "hp": max(hero.health, 0),
-                "base_hp": hero.base_hp,
-                "attack": hero.attack,
-                "defense": hero.defense
-            } for hero in team_b]
-
-            queued_lineup.is_queued = False
+            challenge = LineUp(
+                user_id=current_user.id,
+                hero_1=challenger_ids[0],
+                hero_2=challenger_ids[1],
+                hero_3=challenger_ids[2],
+                is_queued=False,
+                is_challenger=True,
+                opponent_lineup_id=queued_lineup.id,
+                rating=current_user.rating,
+                timestamp=datetime.utcnow()
+            )
+            db.session.add(challenge)
             db.session.commit()
+            battle_pool.submit(run_battle_job, challenge.id)
+            return redirect(url_for('battle', lineup_id=challenge.id))
 
-            return render_template(
-                "battle_result.html",
-                battle_result=result,
-                battle_log=raw_result.log,
-                team_a={
-                    "label": "Posted Lineup",
-                    "owner": queued_owner.username if queued_owner else "Unknown",
-                    "heroes": team_a_state
-                },
-                team_b={
-                    "label": "Challenger",
-                    "owner": current_user.username,
-                    "heroes": team_b_state
-                }
-            )
+    next_opponent = match_candidate(current_user.id, current_user.rating)
+    next_owner = db.session.get(User, next_opponent.user_id) if next_opponent else None
+    waiting_count = opponent_queue(current_user.id).order_by(None).count()
+    my_lineups = (LineUp.query.options(*lineup_heroes_loaded())
+                  .filter_by(user_id=current_user.id, is_queued=True).order_by(LineUp.timestamp).all())
 
+    roster = list(current_user.heroes)
     return render_template(
         "arena.html",
         user_heroes=roster,
         available_heroes=roster,
-        queued_heroes=queued_heroes,
-        queued_owner=queued_owner.username if queued_owner else None,
+        queued_heroes=[next_opponent.hero1, next_opponent.hero2, next_opponent.hero3] if next_opponent else [],
+        queued_owner=next_owner.username if next_owner else None,
+        waiting_count=waiting_count,
+        my_lineups=my_lineups,
+        max_queued_lineups=MAX_QUEUED_LINEUPS,
         challenger_heroes=roster,
         battle_wins=current_user.battle_wins,
-        battle_losses=current_user.battle_losses
+        battle_losses=current_user.battle_losses,
+        rating=round(current_user.rating)
     )
 
+@app.route('/arena/battle/<int:lineup_id>')
+@login_required
+def battle(lineup_id):
+    lineup = LineUp.query.filter_by(id=lineup_id, user_id=current_user.id, is_challenger=True).first()
+    if not lineup:
+        flash("That battle does not exist!", "danger")
+        return redirect(url_for('arena'))
+
+    if not lineup.last_battle_winner:
+        # Also covers battles that failed for good; the page shows an error then instead of polling.
+        return render_template("battle_pending.html", lineup=lineup)
+
+    if lineup.last_battle_unseen:
+        lineup.last_battle_unseen = False
+        db.session.commit()
+    return render_battle_result(lineup)
+
+@app.route('/arena/battle/<int:lineup_id>/status')
+@login_required
+def battle_status(lineup_id):
+    lineup = LineUp.query.filter_by(id=lineup_id, user_id=current_user.id, is_challenger=True).first()
+    if not lineup:
+        return jsonify(error="That battle does not exist!"), 404
+    return jsonify(done=bool(lineup.last_battle_winner), failed=lineup.battle_failed, winner=lineup.last_battle_winner)
+
+BATTLE_HISTORY_PAGE_SIZE = 25
+
+@app.route('/battles')
+@login_required
+def battle_history():
+    before = request.args.get('before', type=int)
+    query = (Battle.query.options(joinedload(Battle.defender), joinedload(Battle.challenger), joinedload(Battle.winner))
+             .filter(db.or_(Battle.defender_id == current_user.id, Battle.challenger_id == current_user.id)))
+    if before:
+        query = query.filter(Battle.id < before)
+    battles = query.order_by(Battle.id.desc()).limit(BATTLE_HISTORY_PAGE_SIZE + 1).all()
+    next_before = battles[BATTLE_HISTORY_PAGE_SIZE - 1].id if len(battles) > BATTLE_HISTORY_PAGE_SIZE else None
+    return render_template("battle_history.html", battles=battles[:BATTLE_HISTORY_PAGE_SIZE], next_before=next_before)
+
+@app.route('/battles/<int:battle_id>')
+@login_required
+def battle_replay(battle_id):
+    battle = db.session.get(Battle, battle_id)
+    if not battle or current_user.id not in (battle.defender_id, battle.challenger_id):
+        flash("That battle does not exist!", "danger")
+        return redirect(url_for('battle_history'))
+
+    battle_log = battle.battle_log()
+    if battle_log is None:
+        flash("No log was kept for this battle.", "info")
+        return redirect(url_for('battle_history'))
+    loser = battle.challenger if battle.winner_id == battle.defender_id else battle.defender
+    return battle_result_page(BattleResult(battle.winner.username, loser.username, battle_log), battle_log)
+
+LEADERBOARD_METRICS = {
+    "rating": "Rating",
+    "battle_wins": "Battle Wins",
+    "collection_size": "Heroes Collected",
+    "rolls_done": "Rolls",
+    "tokens_spent": "Tokens Spent",
+}
+LEADERBOARD_SIZE = 50
+# How often each process's refresher polls for changed users, and how far back it looks
+# so a transaction that committed after stamping updated_at isn't missed.
+LEADERBOARD_POLL_SECONDS = 5
+LEADERBOARD_POLL_OVERLAP = timedelta(seconds=10)
+# A full rebuild also drops deleted users; it's done instead of patching when a poll returns more rows than this.
+LEADERBOARD_REBUILD_SECONDS = 600
+LEADERBOARD_REBUILD_ROWS = 5_000
+USER_ID_BITS = 32
+
+class RankIndex:
+    """Every user's score for one metric, as int64 keys packing (-score, user_id) kept sorted for bisect."""
+
+    # Ties go to the older account; ranks are competition ranks (one plus the users strictly ahead).
+    # ``scores`` is indexed by user id, so each worker's copy costs 16 bytes per user.
+    MISSING = -(1 << 63)
+
+    def __init__(self, rows):
+        pairs = np.fromiter(chain.from_iterable((user_id, score or 0) for user_id, score in rows), dtype=np.float64).reshape(-1, 2)
+        user_ids = pairs[:, 0].astype(np.int64)
+        scores = np.rint(pairs[:, 1]).astype(np.int64)
+        by_user = np.full(int(user_ids.max()) + 1 if len(user_ids) else 1, self.MISSING, dtype=np.int64)
+        by_user[user_ids] = scores
+        self.scores = array("q", by_user.tobytes())
+        self.keys = array("q", np.sort((-scores << USER_ID_BITS) | user_ids).tobytes())
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def _key(score, user_id):
+        return (-score << USER_ID_BITS) | user_id
+
+    def score(self, user_id):
+        if user_id >= len(self.scores) or self.scores[user_id] == self.MISSING:
+            return None
+        return self.scores[user_id]
+
+    def update(self, user_id, score):
+        score = round(score or 0)
+        old = self.score(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self.keys[bisect.bisect_left(self.keys, self._key(old, user_id))]
+        bisect.insort(self.keys, self._key(score, user_id))
+        if user_id >= len(self.scores):
+            self.scores.extend([self.MISSING] * (user_id + 1 - len(self.scores)))
+        self.scores[user_id] = score
+
+    def rank(self, user_id):
+        score = self.score(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.keys, -score << USER_ID_BITS) + 1
+
+    def top(self, limit):
+        """(rank, user_id, score) for the best ``limit`` users."""
+        entries = []
+        for key in self.keys[:limit]:
+            user_id = key & ((1 << USER_ID_BITS) - 1)
+            score = self.scores[user_id]
+            rank = entries[-1][0] if entries and entries[-1][2] == score else len(entries) + 1
+            entries.append((rank, user_id, score))
+        return entries
+
+def fetch_rank_index(metric) -> RankIndex:
+    # Reads only (id, metric), which the column's index covers, and skips ORM row processing.
+    return RankIndex(db.session.connection().execute(db.select(User.id, getattr(User, metric))))
+
+class Leaderboards:
+    """RankIndexes per metric, built on first read and kept current by a background thread in each process."""
+
+    def __init__(self):
+        self._indexes = {}
+        self._wanted = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._synced_at = None
+        self._rebuilt_at = None
+
+    def index(self, metric):
+        """The metric's RankIndex, or None while it is still being built."""
+        with self._lock:
+            index = self._indexes.get(metric)
+            if index is None and metric not in self._wanted:
+                self._wanted.add(metric)
+                self._wake.set()
+            if self._thread is None and not app.testing:
+                self._thread = threading.Thread(target=self._run, name="leaderboards", daemon=True)
+                self._thread.start()
+        return index
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception:
+                app.logger.exception("Leaderboard refresh failed")
+            self._wake.wait(LEADERBOARD_POLL_SECONDS)
+            self._wake.clear()
+
+    def refresh(self):
+        """Build the indexes that were asked for and apply the users changed since the last pass."""
+        started = datetime.utcnow()
+        with self._lock:
+            wanted = set(self._wanted)
+            built = set(self._indexes)
+            synced_at = self._synced_at
+        rebuild_due = self._rebuilt_at is None or time.monotonic() - self._rebuilt_at > LEADERBOARD_REBUILD_SECONDS
+        to_build = wanted if rebuild_due else wanted - built
+        to_patch = built - to_build
+
+        if to_patch and synced_at is not None:
+            names = sorted(to_patch)
+            rows = db.session.connection().execute(
+                db.select(User.id, *(getattr(User, name) for name in names))
+                .where(User.updated_at >= synced_at - LEADERBOARD_POLL_OVERLAP)
+                .limit(LEADERBOARD_REBUILD_ROWS + 1)
+            ).all()
+            if len(rows) > LEADERBOARD_REBUILD_ROWS:
+                to_build |= to_patch
+            else:
+                for user_id, *scores in rows:
+                    # Per row, so readers never wait behind a whole batch of array shifts.
+                    with self._lock:
+                        for name, score in zip(names, scores):
+                            self._indexes[name].update(user_id, score)
+
+        for metric in sorted(to_build):
+            index = fetch_rank_index(metric)
+            with self._lock:
+                self._indexes[metric] = index
+        if rebuild_due:
+            self._rebuilt_at = time.monotonic()
+        self._synced_at = started
+
+leaderboards = Leaderboards()
+
+def leaderboard_entries(index, limit):
+    top = index.top(limit)
+    usernames = dict(db.session.execute(db.select(User.id, User.username).where(User.id.in_([user_id for _, user_id, _ in top]))).all())
+    return [{"rank": rank, "username": usernames.get(user_id), "score": score} for rank, user_id, score in top]
+
+LEADERBOARD_BUILDING = "This leaderboard is being built. Check back in a moment."
+
+@app.route('/leaderboard')
+@app.route('/leaderboard/<metric>')
+@login_required
+@query_budget(6)
+def leaderboard(metric="rating"):
+    if metric not in LEADERBOARD_METRICS:
+        flash("That leaderboard does not exist!", "warning")
+        return redirect(url_for('leaderboard'))
+    index = leaderboards.index(metric)
+    if index is None:
+        return render_template("leaderboard.html", metrics=LEADERBOARD_METRICS, metric=metric, building=LEADERBOARD_BUILDING)
+    return render_template("leaderboard.html",
+                           metrics=LEADERBOARD_METRICS,
+                           metric=metric,
+                           entries=leaderboard_entries(index, LEADERBOARD_SIZE),
+                           my_rank=index.rank(current_user.id),
+                           my_score=index.score(current_user.id) or 0,
+                           total_players=len(index))
+
+@app.route('/leaderboard/<metric>/top')
+@login_required
+def leaderboard_top(metric):
+    if metric not in LEADERBOARD_METRICS:
+        return jsonify(error="That leaderboard does not exist!"), 404
+    index = leaderboards.index(metric)
+    if index is None:
+        return jsonify(error=LEADERBOARD_BUILDING), 503
+    limit = min(max(request.args.get('limit', LEADERBOARD_SIZE, type=int), 1), LEADERBOARD_SIZE)
+    return jsonify(metric=metric, entries=leaderboard_entries(index, limit))
+
+@app.route('/leaderboard/<metric>/me')
+@login_required
+def leaderboard_me(metric):
+    if metric not in LEADERBOARD_METRICS:
+        return jsonify(error="That leaderboard does not exist!"), 404
+    index = leaderboards.index(metric)
+    if index is None:
+        return jsonify(error=LEADERBOARD_BUILDING), 503
+    return jsonify(metric=metric,
+                   rank=index.rank(current_user.id),
+                   score=index.score(current_user.id) or 0,
+                   players=len(index))
+
 @app.route('/add_heroes', methods=['GET', 'POST'])
 @login_required
 def add_heroes():
@@ -877,6 +1735,7 @@ def add_heroes():
         
         new_hero = Hero(name=name, description=description, rarity=rarity, image=image)
         db.session.add(new_hero)
+        invalidate_hero_catalog()
         db.session.commit()
         flash("The hero was successfully added!", "success")
         return redirect(url_for('add_heroes'))
@@ -919,11 +1778,135 @@ def add_achievements():
         
         new_achievement = Achievement(name=name, description=description, type=type, value=value, difficulty=difficulty)
         db.session.add(new_achievement)
+        invalidate_achievement_tracker()
         db.session.commit()
         flash("The achievement was successfully added!", "success")
     
     return render_template("add_achievements.html")
 
+@app.cli.command("backfill-battle-stats")
+def backfill_battle_stats_command():
+    """Set battle_wins/battle_losses to 0 for accounts created before those columns existed."""
+    wins = User.query.filter(User.battle_wins.is_(None)).update({"battle_wins": 0}, synchronize_session=False)
+    losses = User.query.filter(User.battle_losses.is_(None)).update({"battle_losses": 0}, synchronize_session=False)
+    db.session.commit()
+    click.echo(f"Backfilled battle_wins for {wins} users and battle_losses for {losses} users.")
+
+@app.cli.command("backfill-collection-stats")
+def backfill_collection_stats_command():
+    """Recompute every user's collection counter columns from user_heroes."""
+    def owns(name):
+        return db.exists().where(user_heroes.c.user_id == User.id, user_heroes.c.hero_id == Hero.id, Hero.name == name)
+
+    updated = db.session.execute(db.update(User).values(
+        collection_size=db.select(db.func.count()).where(user_heroes.c.user_id == User.id).scalar_subquery(),
+        owns_goku=owns("Goku"),
+        owns_creator=owns("The Creator"),
+        collection_version=User.collection_version + 1,
+    ).execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    click.echo(f"Backfilled collection stats for {updated} users.")
+
+@app.cli.command("recompute-ratings")
+@click.option("--k-factor", type=float, default=K_FACTOR, show_default=True, help="Elo K-factor to replay with.")
+def recompute_ratings_command(k_factor):
+    """Rebuild every user and lineup rating by replaying the battle history; run it while no battles are resolving."""
+    started = time.perf_counter()
+    # Through the connection, so rows skip the ORM result processing.
+    rows = db.session.connection().execute(
+        db.select(Battle.defender_id, Battle.challenger_id, Battle.winner_id,
+                  Battle.defender_lineup_id, Battle.challenger_lineup_id).order_by(Battle.id)
+    ).all()
+    battles = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 5).reshape(-1, 5)
+    defender_ids, challenger_ids, winner_ids, defender_lineups, challenger_lineups = battles.T
+    user_ids, players = np.unique(np.concatenate([defender_ids, challenger_ids]), return_inverse=True)
+    ratings, defender_before, challenger_before, defender_change = replay_ratings(
+        players[:len(battles)], players[len(battles):], winner_ids == defender_ids, len(user_ids), k=k_factor)
+
+    users = User.__table__
+    db.session.execute(db.update(users).values(rating=START_RATING))
+    if len(battles):
+        db.session.execute(
+            db.update(users).where(users.c.id == db.bindparam("user_id")).values(rating=db.bindparam("new_rating")),
+            [{"user_id": user_id, "new_rating": rating} for user_id, rating in zip(user_ids.tolist(), ratings.tolist())])
+        # Two rows per battle; a plain executemany skips the per-row parameter processing of an ORM or Core update.
+        db.session.connection().exec_driver_sql(
+            "UPDATE line_up SET rating = ?, rating_change = ? WHERE id = ?",
+            [(rating, change, lineup_id)
+             for lineup_ids, before, changes in ((defender_lineups, defender_before, defender_change),
+                                                 (challenger_lineups, challenger_before, -defender_change))
+             for lineup_id, rating, change in zip(lineup_ids.tolist(), before.tolist(), changes.tolist())])
+    # Lineups still waiting move to their owner's new rating so matchmaking bands stay right.
+    db.session.execute(db.update(LineUp).where(LineUp.is_queued.is_(True)).values(
+        rating=db.select(User.rating).where(User.id == LineUp.user_id).scalar_subquery()
+    ).execution_options(synchronize_session=False))
+    db.session.commit()
+    click.echo(f"Replayed {len(battles)} battles for {len(user_ids)} players in {time.perf_counter() - started:.2f} s.")
+
+@app.cli.command("sweep-trades")
+@click.option("--batch-size", default=STALE_TRADE_BATCH, show_default=True, help="Trades cancelled per UPDATE.")
+@click.option("--every", type=int, default=None, help="Keep running and sweep every N seconds.")
+def sweep_trades_command(batch_size, every):
+    """Cancel pending trades that refer to heroes their owners no longer hold."""
+    def sweep():
+        cancelled = sweep_stale_trades(batch_size)
+        click.echo(f"Cancelled {cancelled} stale trades.")
+
+    sweep()
+    if every:
+        schedule.every(every).seconds.do(sweep)
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+
+@app.cli.command("run-battles")
+def run_battles_command():
+    """Resolve challenges left pending, e.g. after the web process restarted mid-battle."""
+    pending = db.session.scalars(
+        db.select(LineUp.id)
+        .where(LineUp.is_challenger.is_(True), LineUp.opponent_lineup_id.is_not(None), LineUp.last_battle_winner.is_(None),
+               LineUp.battle_failed.is_(False))
+        .order_by(LineUp.timestamp)
+    ).all()
+    resolved = sum(run_battle_job(lineup_id) for lineup_id in pending)
+    click.echo(f"Resolved {resolved} of {len(pending)} pending battles.")
+
+@app.cli.command("tournament")
+@click.argument("output")
+@click.option("--hero", "hero_ids", type=int, multiple=True, help="Limit the roster to these hero ids.")
+@click.option("--trials", default=200, help="Battles simulated per matchup.")
+@click.option("--chunk-size", default=16, help="Lineup rows per pool task.")
+@click.option("--workers", type=int, default=None, help="Worker processes (defaults to the CPU count).")
+@click.option("--seed", default=0)
+def tournament_command(output, hero_ids, trials, chunk_size, workers, seed):
+    """Simulate every 3-hero lineup against every other and save the win-rate matrix to OUTPUT (.npy)."""
+    query = Hero.query.filter(Hero.id.in_(hero_ids)) if hero_ids else Hero.query
+    roster = [RosterHero.from_hero(hero) for hero in query.all()]
+    try:
+        run_tournament(roster, output, trials=trials, chunk_size=chunk_size, workers=workers, seed=seed, log=click.echo)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+@app.cli.command("simulate-rolls")
+@click.argument("roll_type")
+@click.option("--players", default=1000, help="Fresh accounts to simulate.")
+@click.option("--rolls", "rolls_per_player", default=1000, help="Rolls per simulated account.")
+@click.option("--seed", type=int, default=None)
+def simulate_rolls_command(roll_type, players, rolls_per_player, seed):
+    """Estimate the token economy of ROLL_TYPE against the current hero pool."""
+    if roll_type not in ROLL_TABLES:
+        raise click.ClickException(f"Unknown roll type {roll_type!r}; choose from {', '.join(ROLL_TABLES)}.")
+    pool_sizes = {rarity: len(heroes) for rarity, heroes in hero_catalog().by_rarity.items()}
+    try:
+        estimate = ROLL_TABLES[roll_type].simulate_economy(pool_sizes, players, rolls_per_player, np.random.default_rng(seed))
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"{estimate.rolls} rolls, {estimate.spent} tokens spent, {estimate.refunded} refunded")
+    click.echo(f"net cost per roll: {estimate.net_cost_per_roll:.2f}, duplicate rate: {estimate.duplicate_rate:.1%}")
+    click.echo(f"mean collection size per player: {estimate.mean_collection_size:.1f}")
+    for rarity, count in estimate.rarity_counts.items():
+        click.echo(f"  {rarity}: {count / estimate.rolls:.2%}")
+
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port="5000", debug=True) 
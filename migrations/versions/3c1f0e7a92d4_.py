@@ -0,0 +1,25 @@
+"""empty message
+
+Revision ID: 3c1f0e7a92d4
+Revises: b9ce4af6855b
+Create Date: 2026-10-18 13:21:40.512093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0e7a92d4'
+down_revision = 'b9ce4af6855b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Autogenerate can't reflect expression indexes on SQLite, so this one is written by hand.
+    op.create_index('ix_user_username_lower', 'user', [sa.text('lower(username)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_username_lower', table_name='user')
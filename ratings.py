@@ -0,0 +1,63 @@
+import numpy as np
+
+START_RATING = 1000.0
+K_FACTOR = 32.0
+
+def expected_score(rating, opponent_rating):
+    """Elo win probability; works on floats and on NumPy arrays."""
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+def rating_change(winner_rating: float, loser_rating: float, k: float = K_FACTOR) -> float:
+    """Points the winner of one battle gains and the loser gives up."""
+    return k * (1.0 - expected_score(winner_rating, loser_rating))
+
+def battle_waves(player_a, player_b, players: int):
+    """Number each battle so that battles sharing a wave share no player.
+
+    A battle's wave is one past the latest wave either player already
+    appears in, so each player's battles keep their order across waves.
+    This is the one sequential pass of a recompute, so it sticks to plain
+    lists.
+    """
+    last_wave = [-1] * players
+    waves = []
+    append = waves.append
+    for a, b in zip(player_a.tolist(), player_b.tolist()):
+        wave_a, wave_b = last_wave[a], last_wave[b]
+        wave = (wave_a if wave_a > wave_b else wave_b) + 1
+        last_wave[a] = last_wave[b] = wave
+        append(wave)
+    return np.array(waves, dtype=np.int64)
+
+def replay_ratings(player_a, player_b, a_won, players: int, start: float = START_RATING, k: float = K_FACTOR):
+    """Replay battles in order and return the ratings they produce.
+
+    ``player_a``/``player_b`` hold dense player indices below ``players``
+    and ``a_won`` is 1.0 where player a won, all in battle order. Battles
+    are applied a wave at a time (see battle_waves) with array operations,
+    which gives the same result as applying them one by one.
+
+    Returns ``(ratings, before_a, before_b, change_a)``: the final rating
+    per player, both players' ratings going into each battle, and the
+    points player a gained (negative if they lost).
+    """
+    player_a = np.asarray(player_a, dtype=np.int64)
+    player_b = np.asarray(player_b, dtype=np.int64)
+    a_won = np.asarray(a_won, dtype=np.float64)
+    ratings = np.full(players, start, dtype=np.float64)
+    before_a = np.empty(len(player_a), dtype=np.float64)
+    before_b = np.empty(len(player_a), dtype=np.float64)
+    change_a = np.empty(len(player_a), dtype=np.float64)
+    if not len(player_a):
+        return ratings, before_a, before_b, change_a
+
+    waves = battle_waves(player_a, player_b, players)
+    order = np.argsort(waves, kind="stable")
+    for batch in np.split(order, np.flatnonzero(np.diff(waves[order])) + 1):
+        a, b = player_a[batch], player_b[batch]
+        rating_a, rating_b = ratings[a], ratings[b]
+        change = k * (a_won[batch] - expected_score(rating_a, rating_b))
+        ratings[a] = rating_a + change
+        ratings[b] = rating_b - change
+        before_a[batch], before_b[batch], change_a[batch] = rating_a, rating_b, change
+    return ratings, before_a, before_b, change_a
@@ -0,0 +1,103 @@
+import json, os, random
+import numpy as np
+
+ROLL_TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "roll_tables.json")
+
+class AliasTable:
+    """Walker's alias method: O(1) draws from a fixed discrete distribution."""
+
+    def __init__(self, outcomes, weights):
+        size = len(outcomes)
+        total = sum(weights)
+        scaled = [weight * size / total for weight in weights]
+        self.outcomes = tuple(outcomes)
+        self.accept = [1.0] * size
+        self.alias = list(range(size))
+
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            low = small.pop()
+            high = large.pop()
+            self.accept[low] = scaled[low]
+            self.alias[low] = high
+            scaled[high] += scaled[low] - 1
+            (small if scaled[high] < 1 else large).append(high)
+
+        self._accept_array = np.array(self.accept)
+        self._alias_array = np.array(self.alias)
+
+    def sample(self, rng=random):
+        column = rng.randrange(len(self.outcomes))
+        return self.outcomes[column] if rng.random() < self.accept[column] else self.outcomes[self.alias[column]]
+
+    def sample_indices(self, size, rng) -> np.ndarray:
+        """Draw ``size`` outcome indices at once from a NumPy generator."""
+        columns = rng.integers(0, len(self.outcomes), size=size)
+        return np.where(rng.random(size) < self._accept_array[columns], columns, self._alias_array[columns])
+
+class RollTable:
+    def __init__(self, roll_type, cost, weights, duplicate_refunds):
+        self.roll_type = roll_type
+        self.cost = cost
+        self.weights = dict(weights)
+        self.rarities = tuple(weights)
+        self.duplicate_refunds = duplicate_refunds
+        self.sampler = AliasTable(self.rarities, list(weights.values()))
+
+    def roll(self, rng=random) -> str:
+        return self.sampler.sample(rng)
+
+    def percent(self, rarity) -> int:
+        return round(100 * self.weights.get(rarity, 0) / sum(self.weights.values()))
+
+    def simulate_economy(self, pool_sizes, players: int, rolls_per_player: int, rng=None) -> "EconomyEstimate":
+        """Simulate ``players`` fresh accounts each doing ``rolls_per_player`` rolls of this type.
+
+        ``pool_sizes`` maps rarity to how many heroes of that rarity exist.
+        A roll is a duplicate when the same hero already came up earlier for
+        that player, which is when perform_roll pays the duplicate refund.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        sizes = np.array([pool_sizes.get(rarity, 0) for rarity in self.rarities], dtype=np.int64)
+        if not sizes.all():
+            missing = [rarity for rarity, size in zip(self.rarities, sizes) if not size]
+            raise ValueError(f"No heroes to roll for rarity: {', '.join(missing)}")
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        refunds = np.array([self.duplicate_refunds[rarity] for rarity in self.rarities], dtype=np.int64)
+
+        total = players * rolls_per_player
+        rarity_index = self.sampler.sample_indices(total, rng)
+        hero_index = offsets[rarity_index] + rng.integers(0, sizes[rarity_index])
+        # Number every (player, hero) pair; its first occurrence is the new hero, the rest are duplicates.
+        player = np.repeat(np.arange(players, dtype=np.int64), rolls_per_player)
+        _, first_seen = np.unique(player * int(sizes.sum()) + hero_index, return_index=True)
+        duplicate = np.ones(total, dtype=bool)
+        duplicate[first_seen] = False
+
+        return EconomyEstimate(
+            rolls=total,
+            spent=total * self.cost,
+            refunded=int(refunds[rarity_index][duplicate].sum()),
+            duplicates=int(duplicate.sum()),
+            rarity_counts=dict(zip(self.rarities, np.bincount(rarity_index, minlength=len(self.rarities)).tolist())),
+            mean_collection_size=len(first_seen) / players,
+        )
+
+class EconomyEstimate:
+    def __init__(self, rolls, spent, refunded, duplicates, rarity_counts, mean_collection_size):
+        self.rolls = rolls
+        self.spent = spent
+        self.refunded = refunded
+        self.duplicates = duplicates
+        self.rarity_counts = rarity_counts
+        self.mean_collection_size = mean_collection_size
+        self.net_cost_per_roll = (spent - refunded) / rolls
+        self.duplicate_rate = duplicates / rolls
+
+def load_roll_tables(path: str = ROLL_TABLES_PATH):
+    with open(path) as roll_file:
+        config = json.load(roll_file)
+    refunds = config["duplicate_refunds"]
+    return {roll_type: RollTable(roll_type, table["cost"], table["weights"], refunds)
+            for roll_type, table in config["rolls"].items()}
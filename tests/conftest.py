@@ -0,0 +1,70 @@
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main reads DATABASE_URL at import, so point it at a throwaway database first.
+_database_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_database_dir.name, "test.db")
+
+import pytest
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+
+from main import app as flask_app, db, User, Hero, Trade, LineUp, user_heroes, user_hero_history
+
+# Larger than every budget, so a view that queries once per row cannot stay under it.
+SEEDED_ROWS = 40
+HEROES = 30
+HEROES_PER_USER = 6
+GREEK_TYPES = ["Alpha", "Beta", "Gamma", "Delta", "Epsilon", "Zeta", "Eta"]
+RARITIES = ["common", "rare", "epic", "legendary", "godly"]
+USERNAME = "tester"
+PASSWORD = "secret"
+
+def seed():
+    """SEEDED_ROWS other players with heroes, trades to and from the tester, and queued lineups."""
+    password = generate_password_hash(PASSWORD, method="pbkdf2:sha256")
+    db.session.add_all(Hero(id=hero_id, name=f"Hero {hero_id}", description="A hero.", image=f"/static/{hero_id}.png",
+                            rarity=RARITIES[hero_id % len(RARITIES)], greek_type=GREEK_TYPES[hero_id % len(GREEK_TYPES)])
+                       for hero_id in range(1, HEROES + 1))
+    db.session.add_all(User(id=user_id, username=USERNAME if user_id == 1 else f"player{user_id}", password=password,
+                            tokens=500, security_question="q", security_answer_hash=password,
+                            rating=1000 + (user_id * 37) % 400, rolls_done=user_id, tokens_spent=user_id * 10,
+                            battle_wins=user_id % 7, battle_losses=0, collection_size=HEROES_PER_USER)
+                       for user_id in range(1, SEEDED_ROWS + 2))
+    owned = [{"user_id": user_id, "hero_id": (user_id + offset) % HEROES + 1}
+             for user_id in range(1, SEEDED_ROWS + 2) for offset in range(HEROES_PER_USER)]
+    db.session.execute(user_heroes.insert(), owned)
+    db.session.execute(user_hero_history.insert(), owned)
+
+    tester_heroes = [row["hero_id"] for row in owned if row["user_id"] == 1]
+    now = datetime.utcnow()
+    for other_id in range(2, SEEDED_ROWS + 2):
+        other_hero = other_id % HEROES + 1
+        mine = tester_heroes[other_id % len(tester_heroes)]
+        db.session.add(Trade(sender_id=other_id, receiver_id=1, offeredHero_id=other_hero, requestedHero_id=mine))
+        db.session.add(Trade(sender_id=1, receiver_id=other_id, offeredHero_id=mine, requestedHero_id=other_hero))
+        db.session.add(LineUp(user_id=other_id, hero_1=other_hero, hero_2=(other_id + 1) % HEROES + 1,
+                              hero_3=(other_id + 2) % HEROES + 1, is_queued=True, rating=1000 + (other_id * 37) % 400,
+                              timestamp=now - timedelta(minutes=other_id)))
+    for slot in range(3):
+        db.session.add(LineUp(user_id=1, hero_1=tester_heroes[slot], hero_2=tester_heroes[slot + 1],
+                              hero_3=tester_heroes[slot + 2], is_queued=True, rating=1000, timestamp=now))
+    db.session.commit()
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        db.create_all()
+        seed()
+    yield flask_app
+    with flask_app.app_context():
+        db.engine.dispose()
+    _database_dir.cleanup()
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+    return client
@@ -0,0 +1,93 @@
+import copy, random
+import numpy as np
+
+from battle_logic import (BattleEngine, BattleLog, HeroStats, TYPE_ORDER, advantages, run_battle_batch,
+                          simulate_battle, team_synergies)
+
+MATCHUPS = 300
+
+def reference_battle(team_a, team_b, name_a, name_b, rng):
+    """The turn loop simulate_battle ran before BattleEngine, with synergy applied once to copies."""
+    teams = [[copy.copy(hero) for hero in team_a], [copy.copy(hero) for hero in team_b]]
+    names = (name_a, name_b)
+    log = []
+    for team, name in zip(teams, names):
+        synergy = team_synergies.get(tuple(sorted(hero.greek_type.lower() for hero in team)), {})
+        for hero in team:
+            if "attack_boost" in synergy:
+                hero.base_attack = int(hero.base_attack * synergy["attack_boost"])
+            if "defense_boost" in synergy:
+                hero.base_defense = int(hero.base_defense * synergy["defense_boost"])
+            if "base_hp_boost" in synergy:
+                hero.base_hp = int(hero.base_hp * synergy["base_hp_boost"])
+        if synergy:
+            log.append(f"{name}'s team synergy activated!")
+
+    turn = rng.randint(0, 1)
+    log.append(f"{names[turn]} starts the battle!")
+    while True:
+        miss_random = rng.randint(1, 100)
+        attacker = next((hero for hero in teams[turn] if hero.base_hp > 0), None)
+        defender = next((hero for hero in teams[1 - turn] if hero.base_hp > 0), None)
+        if not attacker and not defender:
+            log.append("Both teams are out of heroes!")
+            return "Draw", "Draw", log
+        if not attacker or not defender:
+            winner = 1 - turn if not attacker else turn
+            log.append(f"{names[winner]} wins the battle!")
+            return names[winner], names[1 - winner], log
+
+        attacker_type, defender_type = attacker.greek_type.lower(), defender.greek_type.lower()
+        if miss_random <= 10:
+            log.append(f"{attacker.name} tried to attack {defender.name} but missed!")
+        else:
+            if advantages.get(attacker_type) == defender_type:
+                attack_value, verb = int(attacker.base_attack * 1.15) - defender.base_defense, "deals a super effective hit against"
+            elif advantages.get(defender_type) == attacker_type:
+                attack_value, verb = int(attacker.base_attack * 0.85) - defender.base_defense, "deals a not very effective hit against"
+            else:
+                attack_value, verb = attacker.base_attack - defender.base_defense, "attacks"
+            dealt = max(attack_value, 1)
+            defender.base_hp = max(defender.base_hp - dealt, 0)
+            log.append(f"{attacker.name} {verb} {defender.name}, dealing {dealt} damage!, leaving them with {defender.base_hp} HP!")
+        turn = 1 - turn
+
+def random_team(rng, prefix):
+    # Every third team is a synergy combo, so the boosts are exercised as often as plain teams.
+    if rng.randrange(3) == 0:
+        types = list(rng.choice(list(team_synergies)))
+    else:
+        types = [rng.choice(TYPE_ORDER) for _ in range(3)]
+    return [HeroStats(f"{prefix}{slot}", greek_type.capitalize(), rng.randint(40, 300), rng.randint(10, 90), rng.randint(0, 60))
+            for slot, greek_type in enumerate(types)]
+
+def matchups():
+    rng = random.Random(1)
+    return [(random_team(rng, "a"), random_team(rng, "b")) for _ in range(MATCHUPS)]
+
+class NumpyDraws:
+    """Hands BattleEngine.run the same draws run_battle_batch takes for a batch of one battle."""
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def randint(self, low, high):
+        if (low, high) == (0, 1):
+            return int(self.rng.integers(0, 2, size=1)[0])
+        return int(self.rng.random(1)[0] * 100) + 1
+
+def test_engine_replays_the_reference_turn_loop():
+    for seed, (team_a, team_b) in enumerate(matchups()):
+        before = [hero.to_list() for hero in team_a + team_b]
+        result = simulate_battle(team_a, team_b, "Alice", "Bob", seed=seed)
+        expected = reference_battle(team_a, team_b, "Alice", "Bob", random.Random(seed))
+        assert (result.winner, result.loser, list(result.log)) == expected, seed
+        assert simulate_battle(team_a, team_b, "Alice", "Bob", keep_log=False, seed=seed).winner == result.winner
+        assert [hero.to_list() for hero in team_a + team_b] == before
+
+def test_battle_batch_matches_engine_draw_for_draw():
+    for seed, (team_a, team_b) in enumerate(matchups()):
+        winners, lengths = run_battle_batch([BattleEngine(team_a, team_b)], 1, np.random.default_rng(seed))
+        log = BattleLog(("A", "B"), None)
+        winner = BattleEngine(team_a, team_b).run(rng=NumpyDraws(np.random.default_rng(seed)), log=log)
+        assert (winners[0, 0], lengths[0, 0]) == (winner, len(log.events)), seed
@@ -0,0 +1,25 @@
+from main import db, leaderboards, backfill_collection_stats_command, User, user_heroes
+
+def test_collection_leaderboard_follows_backfilled_counters(app, client):
+    with app.app_context():
+        # player2 and player3 pick up heroes outside update_collection_stats, and every counter reads 0,
+        # as on a deployment whose counters were never filled in.
+        db.session.execute(user_heroes.insert(), [{"user_id": 2, "hero_id": hero_id} for hero_id in (20, 21, 22)]
+                                                 + [{"user_id": 3, "hero_id": 20}])
+        db.session.execute(db.update(User).values(collection_size=0))
+        db.session.commit()
+
+    client.get("/leaderboard/collection_size/me")
+    with app.app_context():
+        leaderboards.refresh()
+    assert client.get("/leaderboard/collection_size/me").get_json()["rank"] == 1
+
+    result = app.test_cli_runner().invoke(backfill_collection_stats_command)
+    assert result.exit_code == 0
+    with app.app_context():
+        leaderboards.refresh()
+
+    top = client.get("/leaderboard/collection_size/top", query_string={"limit": 3}).get_json()["entries"]
+    assert [(entry["rank"], entry["username"], entry["score"]) for entry in top[:2]] == [(1, "player2", 9), (2, "player3", 7)]
+    me = client.get("/leaderboard/collection_size/me").get_json()
+    assert (me["rank"], me["score"]) == (3, 6)
@@ -0,0 +1,48 @@
+import pytest
+
+from main import db, leaderboards, query_budget, QueryBudgetExceeded, Trade, TRADE_LIST_OPTIONS
+
+@pytest.mark.parametrize("path", ["/trade", "/trade/listings", "/arena"])
+def test_view_stays_within_query_budget(client, path):
+    # query_budget raises QueryBudgetExceeded under testing, which the test client propagates.
+    response = client.get(path)
+    assert response.status_code == 200
+
+def test_leaderboard_stays_within_query_budget(app, client):
+    # The first read asks for the index; the background refresher isn't started under testing, so build it here.
+    assert b"being built" in client.get("/leaderboard").data
+    with app.app_context():
+        leaderboards.refresh()
+    response = client.get("/leaderboard")
+    assert response.status_code == 200
+    assert b"tester (you)" in response.data
+
+def test_trade_listings_pages_stay_within_query_budget(client):
+    listings = client.get("/trade/listings").get_json()
+    assert listings["listings"] and listings["next"]
+    assert client.get("/trade/listings", query_string={"after": listings["next"]}).status_code == 200
+
+def test_trade_listings_search_matches_player_prefix_or_hero_name(client):
+    players = client.get("/trade/listings", query_string={"search": "PLAYER2"}).get_json()["listings"]
+    assert players and all(listing["owner"].startswith("player2") for listing in players)
+    heroes = client.get("/trade/listings", query_string={"search": "ero 3"}).get_json()["listings"]
+    assert heroes and all(listing["hero"] in ("Hero 3", "Hero 30") for listing in heroes)
+
+def test_query_budget_catches_n_plus_one(app):
+    @query_budget(5)
+    def incoming_senders():
+        # Trade.sender is lazy, so this loads each sender with its own query.
+        return [trade.sender.username for trade in Trade.query.filter_by(receiver_id=1).all()]
+
+    with app.test_request_context():
+        with pytest.raises(QueryBudgetExceeded):
+            incoming_senders()
+        db.session.rollback()
+
+def test_query_budget_allows_eager_loading(app):
+    @query_budget(5)
+    def incoming_senders():
+        return [trade.sender.username for trade in Trade.query.options(*TRADE_LIST_OPTIONS).filter_by(receiver_id=1).all()]
+
+    with app.test_request_context():
+        assert len(incoming_senders()) == 40
@@ -0,0 +1,52 @@
+import threading
+
+from main import db, User, Trade, TradeError, execute_trade, user_heroes
+
+def holdings(user_id):
+    return set(db.session.scalars(db.select(user_heroes.c.hero_id).where(user_heroes.c.user_id == user_id)))
+
+def test_concurrent_accepts_execute_a_trade_once(app):
+    # Players of their own, so the seeded trades and collections other tests read stay as they are.
+    alice, bob, carol = 201, 202, 203
+    with app.app_context():
+        db.session.add_all(User(id=user_id, username=f"trader{user_id}", password="x", collection_size=2)
+                           for user_id in (alice, bob, carol))
+        db.session.execute(user_heroes.insert(), [{"user_id": alice, "hero_id": 1}, {"user_id": alice, "hero_id": 4},
+                                                  {"user_id": bob, "hero_id": 2}, {"user_id": bob, "hero_id": 5},
+                                                  {"user_id": carol, "hero_id": 3}, {"user_id": carol, "hero_id": 6}])
+        trade = Trade(sender_id=alice, offeredHero_id=1, receiver_id=bob, requestedHero_id=2)
+        competing = [Trade(sender_id=carol, offeredHero_id=3, receiver_id=alice, requestedHero_id=1),
+                     Trade(sender_id=bob, offeredHero_id=2, receiver_id=carol, requestedHero_id=3)]
+        unrelated = Trade(sender_id=carol, offeredHero_id=6, receiver_id=alice, requestedHero_id=4)
+        db.session.add_all([trade, *competing, unrelated])
+        db.session.commit()
+        trade_id, competing_ids, unrelated_id = trade.id, [other.id for other in competing], unrelated.id
+
+    # Both accepts read the trade at the same version before either writes.
+    ready = threading.Barrier(2)
+    results = []
+    def accept():
+        with app.app_context():
+            pending = db.session.get(Trade, trade_id)
+            ready.wait()
+            try:
+                results.append(execute_trade(pending))
+            except TradeError as error:
+                results.append(error)
+
+    threads = [threading.Thread(target=accept) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [result for result in results if not isinstance(result, TradeError)] == [len(competing)]
+    assert [str(result) for result in results if isinstance(result, TradeError)] == ["This trade no longer is available"]
+    with app.app_context():
+        assert holdings(alice) == {2, 4}
+        assert holdings(bob) == {1, 5}
+        assert [user.collection_size for user in db.session.scalars(db.select(User).where(User.id.in_((alice, bob))))] == [2, 2]
+        statuses = dict(db.session.execute(db.select(Trade.id, Trade.status).where(
+            Trade.id.in_([trade_id, *competing_ids, unrelated_id]))).all())
+        assert statuses == {trade_id: "accepted", competing_ids[0]: "cancelled", competing_ids[1]: "cancelled",
+                            unrelated_id: "pending"}
@@ -0,0 +1,120 @@
+import itertools, json, os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from battle_logic import TEAM_A, TEAM_B, BattleEngine, run_battle_batch
+
+# Matchups simulated per vectorized batch inside a task; bounds worker memory.
+MATCHUP_BATCH = 512
+
+class RosterHero:
+    """Plain, picklable copy of the Hero columns a battle needs."""
+
+    __slots__ = ("id", "name", "greek_type", "base_hp", "base_attack", "base_defense")
+
+    def __init__(self, id, name, greek_type, base_hp, base_attack, base_defense):
+        self.id = id
+        self.name = name
+        self.greek_type = greek_type
+        self.base_hp = base_hp
+        self.base_attack = base_attack
+        self.base_defense = base_defense
+
+    @classmethod
+    def from_hero(cls, hero) -> "RosterHero":
+        return cls(hero.id, hero.name, hero.greek_type, hero.base_hp, hero.base_attack, hero.base_defense)
+
+def build_lineups(roster):
+    return list(itertools.combinations(roster, 3))
+
+def _progress_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + ".progress.json"
+
+def _lineups_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + ".lineups.npy"
+
+_worker_lineups = None
+
+def _init_worker(roster):
+    global _worker_lineups
+    _worker_lineups = build_lineups(roster)
+
+def _simulate_rows(row_start: int, row_stop: int, trials: int, seed: int):
+    """Play lineup ``row`` against every later lineup for each row in the chunk.
+
+    Each row draws from its own generator seeded with (seed, row), so results
+    do not depend on the chunk size or on which worker picks the chunk up.
+    """
+    lineups = _worker_lineups
+    results = []
+    for row in range(row_start, row_stop):
+        rng = np.random.default_rng([seed, row])
+        wins = np.empty(len(lineups) - row - 1, dtype=np.float32)
+        losses = np.empty(len(lineups) - row - 1, dtype=np.float32)
+        for batch_start in range(row + 1, len(lineups), MATCHUP_BATCH):
+            opponents = range(batch_start, min(batch_start + MATCHUP_BATCH, len(lineups)))
+            engines = [BattleEngine(lineups[row], lineups[column]) for column in opponents]
+            winners, _ = run_battle_batch(engines, trials, rng)
+            offset = batch_start - row - 1
+            wins[offset:offset + len(engines)] = np.count_nonzero(winners == TEAM_A, axis=1) / trials
+            losses[offset:offset + len(engines)] = np.count_nonzero(winners == TEAM_B, axis=1) / trials
+        results.append((row, wins, losses))
+    return results
+
+def run_tournament(roster, output_path: str, trials: int = 200, chunk_size: int = 16, workers=None, seed: int = 0, log=print):
+    """Round-robin every 3-hero lineup from ``roster`` and write the win-rate matrix.
+
+    ``matrix[i, j]`` in the ``.npy`` file at ``output_path`` is the chance
+    that lineup i beats lineup j; the diagonal is NaN. Lineup i is the hero
+    ids in row i of the ``.lineups.npy`` file next to it. Rows are handed
+    out to a process pool in chunks and a ``.progress.json`` file records
+    the finished chunks, so rerunning with the same arguments resumes where
+    an interrupted run stopped.
+    """
+    roster = sorted(roster, key=lambda hero: hero.id)
+    lineups = build_lineups(roster)
+    if len(lineups) < 2:
+        raise ValueError("A tournament needs at least four heroes.")
+
+    settings = {
+        "hero_ids": [hero.id for hero in roster],
+        "trials": trials,
+        "chunk_size": chunk_size,
+        "seed": seed,
+    }
+    progress_path = _progress_path(output_path)
+    done = set()
+    if os.path.exists(progress_path) and os.path.exists(output_path):
+        with open(progress_path) as progress_file:
+            progress = json.load(progress_file)
+        if progress["settings"] != settings:
+            raise ValueError(f"{output_path} was started with different settings; delete {progress_path} to start over.")
+        done = set(progress["done"])
+        matrix = np.lib.format.open_memmap(output_path, mode="r+")
+    else:
+        matrix = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=(len(lineups), len(lineups)))
+        matrix[:] = np.nan
+        np.save(_lineups_path(output_path), np.array([[hero.id for hero in lineup] for lineup in lineups], dtype=np.int64))
+
+    chunks = [(index, start, min(start + chunk_size, len(lineups)))
+              for index, start in enumerate(range(0, len(lineups), chunk_size))]
+    pending = [chunk for chunk in chunks if chunk[0] not in done]
+    log(f"{len(lineups)} lineups, {len(chunks)} chunks, {len(pending)} left to run")
+
+    def save_progress():
+        matrix.flush()
+        with open(progress_path + ".tmp", "w") as progress_file:
+            json.dump({"settings": settings, "done": sorted(done)}, progress_file)
+        os.replace(progress_path + ".tmp", progress_path)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(roster,)) as pool:
+        futures = {pool.submit(_simulate_rows, start, stop, trials, seed): index for index, start, stop in pending}
+        for future in as_completed(futures):
+            for row, wins, losses in future.result():
+                matrix[row, row + 1:] = wins
+                matrix[row + 1:, row] = losses
+            done.add(futures[future])
+            save_progress()
+            log(f"chunk {futures[future]} done ({len(done)}/{len(chunks)})")
+
+    save_progress()
+    return matrix